@@ -0,0 +1,250 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import Scheduler
+import Server
+from db.ConnectionManager import ConnectionManager
+from db.Storage import Storage, get_storage
+from util.Metrics import metrics
+from util.Util import Util
+
+
+COMMANDS = ["create_patient", "login_patient", "search_caregiver_schedule", "reserve", "show_appointments"]
+DEFAULT_MIX = "search_caregiver_schedule=50,show_appointments=20,reserve=15,login_patient=10,create_patient=5"
+PASSWORD = "Bench#Passw0rd"
+FIRST_DAY = datetime.datetime(2030, 1, 1)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        command, weight = part.split("=")
+        if command not in COMMANDS:
+            raise ValueError(f"Unknown command in mix: {command}")
+        mix[command] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """Per-command latencies and failures, shared by all simulated users."""
+
+    def __init__(self):
+        self.latencies = {command: [] for command in COMMANDS}
+        self.failures = {command: 0 for command in COMMANDS}
+        self._lock = threading.Lock()
+
+    def record(self, command, seconds, failed):
+        with self._lock:
+            self.latencies[command].append(seconds)
+            self.failures[command] += failed
+
+
+class SimulatedUser(threading.Thread):
+    def __init__(self, index, args, mix, recorder, deadline):
+        super().__init__(name=f"user-{index}", daemon=True)
+        self.index = index
+        self.args = args
+        self.random = random.Random(args.seed + index)
+        self.commands = list(mix)
+        self.weights = [mix[command] for command in self.commands]
+        self.recorder = recorder
+        self.deadline = deadline
+        self.session = Scheduler.Session(out=io.StringIO())
+        self.created = 0
+
+    def run(self):
+        with Scheduler.use_session(self.session):
+            for _ in range(self.args.ops):
+                if time.monotonic() > self.deadline:
+                    break
+                command = self.random.choices(self.commands, self.weights)[0]
+                if command in ("search_caregiver_schedule", "reserve", "show_appointments") \
+                        and self.session.current_patient is None:
+                    self.execute("login_patient", self.login_line())
+                if command == "login_patient":
+                    line = self.login_line()
+                elif command == "create_patient":
+                    self.created += 1
+                    line = f"create_patient bench_new_{self.index}_{self.created} {PASSWORD}"
+                elif command == "search_caregiver_schedule":
+                    line = f"search_caregiver_schedule {self.random_day()}"
+                elif command == "reserve":
+                    line = f"reserve {self.random_day()} vaccine{self.random.randrange(self.args.vaccines)}"
+                else:
+                    line = "show_appointments --limit 20"
+                self.execute(command, line)
+
+    def login_line(self):
+        # log out client-side so the next login_patient is accepted
+        self.session.current_patient = None
+        return f"login_patient patient{self.random.randrange(self.args.patients)} {PASSWORD}"
+
+    def random_day(self):
+        day = FIRST_DAY + datetime.timedelta(days=self.random.randrange(self.args.days))
+        return day.strftime("%m-%d-%Y")
+
+    def execute(self, command, line):
+        self.session.out = io.StringIO()
+        start = time.perf_counter()
+        ok = Scheduler.execute(line)
+        elapsed = time.perf_counter() - start
+        self.recorder.record(command, elapsed, ok is None)
+
+
+def seed(storage, args):
+    salt = Util.generate_salt()
+    hash = Util.generate_hash(PASSWORD, salt)
+    days = [FIRST_DAY + datetime.timedelta(days=i) for i in range(args.days)]
+    for i in range(args.caregivers):
+        storage.add_account(Storage.CAREGIVERS, f"caregiver{i}", salt, hash, Util.WORK_FACTOR)
+        if args.shift:
+            hours, _, slot_minutes = args.shift.partition("/")
+            start, end = (Scheduler.parse_time(bound) for bound in hours.split("-"))
+            storage.add_shifts(f"caregiver{i}", days, start, end, int(slot_minutes or Scheduler.SLOT_MINUTES))
+        else:
+            storage.add_availabilities(f"caregiver{i}", days)
+    for i in range(args.patients):
+        storage.add_account(Storage.PATIENTS, f"patient{i}", salt, hash, Util.WORK_FACTOR)
+    storage.add_doses({f"vaccine{k}": args.doses for k in range(args.vaccines)})
+
+
+def check_integrity(args):
+    # correctness after the run: no caregiver booked twice on a day (or in a shift slot), no negative
+    # inventory, and every dose that left inventory belongs to an appointment
+    with ConnectionManager() as conn:
+        double_booked = conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT Caregiver, Date, Slot FROM Appointments GROUP BY Caregiver, Date, Slot HAVING COUNT(*) > 1
+            )
+        """).fetchone()[0]
+        negative_doses = conn.execute("SELECT COUNT(*) FROM Vaccines WHERE Doses < 0").fetchone()[0]
+        doses_left = conn.execute("SELECT SUM(Doses) FROM Vaccines").fetchone()[0]
+        booked = conn.execute("SELECT COUNT(*) FROM Appointments").fetchone()[0]
+        per_caregiver = [row[0] for row in conn.execute(
+            "SELECT COUNT(Appointment_id) FROM Caregivers LEFT JOIN Appointments ON Caregiver = Username "
+            "GROUP BY Username")]
+    integrity = {
+        "double_booked_caregiver_days": double_booked,
+        "vaccines_with_negative_doses": negative_doses,
+        "doses_unaccounted_for": args.vaccines * args.doses - doses_left - booked,
+    }
+    # how evenly the assignment strategy spread the bookings; informational, not a check
+    spread = {"fewest": min(per_caregiver, default=0), "most": max(per_caregiver, default=0)}
+    return integrity, spread
+
+
+def report(recorder, elapsed, integrity, spread):
+    summary = {"elapsed_seconds": round(elapsed, 3), "commands": {}, "integrity": integrity,
+               "bookings_per_caregiver": spread}
+    total = 0
+    for command in COMMANDS:
+        latencies = sorted(recorder.latencies[command])
+        if not latencies:
+            continue
+        total += len(latencies)
+        summary["commands"][command] = {
+            "count": len(latencies),
+            "throughput_per_second": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            # run_command labels metrics with the command name, so these only cover the run itself
+            "statements_per_command": round(metrics.queries.get(command, 0) / len(latencies), 2),
+            "connections_opened": metrics.connections.get(command, 0),
+            "failures": recorder.failures[command],
+        }
+    summary["throughput_per_second"] = round(total / elapsed, 1)
+    return summary
+
+
+def print_report(summary):
+    print(f"{'command':<28}{'count':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'stmts/op':>10}{'conns':>7}{'failed':>8}")
+    for command, row in summary["commands"].items():
+        print(f"{command:<28}{row['count']:>8}{row['throughput_per_second']:>10}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['statements_per_command']:>10}"
+              f"{row['connections_opened']:>7}{row['failures']:>8}")
+    print(f"total throughput: {summary['throughput_per_second']} commands/s in {summary['elapsed_seconds']}s")
+    spread = summary["bookings_per_caregiver"]
+    print(f"bookings per caregiver: {spread['fewest']} to {spread['most']}")
+    for check, value in summary["integrity"].items():
+        print(f"{check}: {value}{'' if value == 0 else '  <-- FAILED'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a concurrent command mix against a local scheduler.")
+    parser.add_argument("--caregivers", type=int, default=50)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--vaccines", type=int, default=3, help="vaccine lots to seed")
+    parser.add_argument("--doses", type=int, default=1000, help="doses per vaccine lot")
+    parser.add_argument("--days", type=int, default=30, help="days of availability per caregiver")
+    parser.add_argument("--shift", default=None,
+                        help="publish HH:MM-HH:MM[/slot minutes] shifts instead of whole-day availability")
+    parser.add_argument("--users", type=int, default=16, help="concurrent simulated users")
+    parser.add_argument("--ops", type=int, default=200, help="commands per simulated user")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="command=weight,... (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=414)
+    parser.add_argument("--strategy", default=None,
+                        help="caregiver assignment strategy (default: AssignmentStrategy or least_booked)")
+    parser.add_argument("--db", default=None, help="SQLite file to use (default: a fresh temporary file)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    workdir = None
+    if args.db is None:
+        workdir = tempfile.TemporaryDirectory(prefix="scheduler-bench-")
+        args.db = os.path.join(workdir.name, "bench.db")
+    # always a local SQLite database; read when the pool and storage are first created below
+    os.environ["Backend"] = "sqlite"
+    os.environ["SqlitePath"] = args.db
+    os.environ.setdefault("PoolMaxSize", str(args.users + 2))
+    if args.strategy:
+        os.environ["AssignmentStrategy"] = args.strategy
+
+    storage = get_storage()
+    seed(storage, args)
+    metrics.enabled = True
+    metrics.reset()
+    recorder = Recorder()
+
+    stdout = sys.stdout
+    sys.stdout = Server.SessionStdout(stdout)
+    deadline = time.monotonic() + (args.duration if args.duration else float("inf"))
+    users = [SimulatedUser(i, args, parse_mix(args.mix), recorder, deadline) for i in range(args.users)]
+    start = time.perf_counter()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - start
+    sys.stdout = stdout
+
+    summary = report(recorder, elapsed, *check_integrity(args))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary)
+    ConnectionManager.close_pool()
+    if workdir is not None:
+        workdir.cleanup()
+    sys.exit(0 if all(value == 0 for value in summary["integrity"].values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,84 @@
 from model.Vaccine import Vaccine
 from model.Caregiver import Caregiver
 from model.Patient import Patient
+from model.Appointment import Appointment
+from model.Waitlist import Waitlist
+from util.Forecast import forecast_depletion
+from util.Metrics import metrics
 from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.ConnectionManager import ConnectionManager, ReadYourWrites
+from db.Schema import Schema
+from db.SiteRouter import get_router
+from db.Storage import Storage, StorageError, UsernameTaken, get_storage
+import argparse
+import contextlib
+import contextvars
+import csv
 import datetime
+import io
+import json
+import os
+import sys
 import traceback
 
 
-'''
-objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
-'''
-current_patient = None
+class Session:
+    '''
+    objects to keep track of the currently logged-in user
+    Note: it is always true that at most one of current_caregiver and current_patient is not null
+            since only one user can be logged-in at a time per session
+    '''
+    def __init__(self, out=None):
+        self.current_patient = None
+        self.current_caregiver = None
+        # the site the session's commands run at (see db.SiteRouter); None is the home site
+        self.site = None
+        # when the session last wrote to each site, so its reads there skip a replica that may not have the write
+        self.writes = ReadYourWrites()
+        # where this session's output goes; None means the process's stdout
+        self.out = out
+
+
+# the interactive console session; servers bind one Session per client with use_session()
+console_session = Session()
+
+_session = contextvars.ContextVar("session")
 
-current_caregiver = None
+
+def current_session():
+    return _session.get(console_session)
+
+
+@contextlib.contextmanager
+def use_session(session):
+    token = _session.set(session)
+    try:
+        yield session
+    finally:
+        _session.reset(token)
 
 
 def create_patient(tokens):
-    # create_patient <username> <password>
-    # check 1: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # create_patient <username> <password> [site]
+    # check 1: the length for tokens need to be 3 or 4 to include all information (with the operation name)
+    if len(tokens) not in (3, 4):
         print("Failed to create user.")
         return
 
     username = tokens[1]
     password = tokens[2]
-    # check 2: check if the username has been taken already
-    if username_exists_patient(username):
+    try:
+        site = get_router().check(tokens[3].lower()) if len(tokens) == 4 else get_router().home
+    except ValueError as e:
+        print("Failed to create user.")
+        print(e)
+        return
+    # check 2: reject a username known to be taken before paying for the password hash; this is
+    # only a fast path, the insert below is what enforces unique usernames
+    taken = username_taken(Storage.PATIENTS, username)
+    if taken is None:
+        return
+    if taken:
         print("Username taken, try again!")
         return
 
@@ -46,31 +96,48 @@ def create_patient(tokens):
     # create the patient
     patient = Patient(username, salt=salt, hash=hash)
 
-    # save to patient information to our database
+    # save to patient information to the site's database in a single insert
     try:
-        patient.save_to_db()
-    except pymssql.Error as e:
+        with get_router().use(site):
+            patient.save_to_db()
+    except UsernameTaken:
+        print("Username taken, try again!")
+        return
+    except StorageError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Failed to create user.")
         print(e)
         return
     print("Created user ", username)
+    if get_router().sharded:
+        print(f"Site: {site}")
+    return True
 
 
 def create_caregiver(tokens):
-    # create_caregiver <username> <password>
-    # check 1: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # create_caregiver <username> <password> [site]
+    # check 1: the length for tokens need to be 3 or 4 to include all information (with the operation name)
+    if len(tokens) not in (3, 4):
         print("Failed to create user.")
         return
 
     username = tokens[1]
     password = tokens[2]
-    # check 2: check if the username has been taken already
-    if username_exists_caregiver(username):
+    try:
+        site = get_router().check(tokens[3].lower()) if len(tokens) == 4 else get_router().home
+    except ValueError as e:
+        print("Failed to create user.")
+        print(e)
+        return
+    # check 2: reject a username known to be taken before paying for the password hash; this is
+    # only a fast path, the insert below is what enforces unique usernames
+    taken = username_taken(Storage.CAREGIVERS, username)
+    if taken is None:
+        return
+    if taken:
         print("Username taken, try again!")
         return
     
@@ -88,69 +155,66 @@ def create_caregiver(tokens):
     # create the caregiver
     caregiver = Caregiver(username, salt=salt, hash=hash)
 
-    # save to caregiver information to our database
+    # save to caregiver information to the site's database in a single insert
     try:
-        caregiver.save_to_db()
-    except pymssql.Error as e:
+        with get_router().use(site):
+            caregiver.save_to_db()
+    except UsernameTaken:
+        print("Username taken, try again!")
+        return
+    except StorageError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Failed to create user.")
         print(e)
         return
     print("Created user ", username)
+    if get_router().sharded:
+        print(f"Site: {site}")
+    return True
 
 
-def username_exists_caregiver(username):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-
-    select_username = "SELECT * FROM Caregivers WHERE Username = %s"
+def username_taken(table, username):
+    # answered from the username filter (UsernameFilter=1) without a query for names it has not seen; with
+    # sites, usernames are unique across all of them, which takes a lookup at each. None if the lookup failed
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
+        if get_router().sharded:
+            return bool(account_sites(table, username))
+        return get_storage().username_taken(table, username)
+    except StorageError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
-        quit()
+        return None
     except Exception as e:
         print("Error occurred when checking username")
         print("Error:", e)
-    finally:
-        cm.close_connection()
     return False
 
-def username_exists_patient(username):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
+def account_sites(table, username):
+    # the sites whose database holds the account, looked up at every site in parallel; without sites,
+    # the one database is assumed to and nothing is looked up
+    router = get_router()
+    if not router.sharded:
+        return [router.home]
+    found = router.fan_out(lambda site: get_storage().username_exists(table, username))
+    return [site for site, exists in found.items() if exists]
+
+
+def per_site(fetch):
+    # [(site, fetch() run at that site)], every site in parallel when sites are configured; site is None without
+    router = get_router()
+    if not router.sharded:
+        return [(None, fetch())]
+    return list(router.fan_out(lambda site: fetch()).items())
 
-    select_username = "SELECT * FROM Patients WHERE Username = %s"
-    try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
-        print("Error occurred when checking username")
-        print("Db-Error:", e)
-        quit()
-    except Exception as e:
-        print("Error occurred when checking username")
-        print("Error:", e)
-    finally:
-        cm.close_connection()
-    return False
 
 def login_patient(tokens):
     # login_patient <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    if current_caregiver is not None or current_patient is not None:
+    session = current_session()
+    if session.current_caregiver is not None or session.current_patient is not None:
         print("User already logged in.")
         return
 
@@ -163,12 +227,17 @@ def login_patient(tokens):
     password = tokens[2]
 
     patient = None
+    site = None
     try:
-        patient = Patient(username, password=password).get()
-    except pymssql.Error as e:
+        sites = account_sites(Storage.PATIENTS, username)
+        if sites:
+            site = sites[0]
+            with get_router().use(site):
+                patient = Patient(username, password=password).get()
+    except StorageError as e:
         print("Login failed.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Login failed.")
         print("Error:", e)
@@ -179,14 +248,16 @@ def login_patient(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_patient = patient
+        session.current_patient = patient
+        session.site = site
+        return True
 
 
 def login_caregiver(tokens):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    session = current_session()
+    if session.current_caregiver is not None or session.current_patient is not None:
         print("User already logged in.")
         return
 
@@ -199,12 +270,17 @@ def login_caregiver(tokens):
     password = tokens[2]
 
     caregiver = None
+    site = None
     try:
-        caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+        sites = account_sites(Storage.CAREGIVERS, username)
+        if sites:
+            site = sites[0]
+            with get_router().use(site):
+                caregiver = Caregiver(username, password=password).get()
+    except StorageError as e:
         print("Login failed.")
         print("Db-Error:", e)
-        quit()
+        return
     except Exception as e:
         print("Login failed.")
         print("Error:", e)
@@ -215,7 +291,9 @@ def login_caregiver(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_caregiver = caregiver
+        session.current_caregiver = caregiver
+        session.site = site
+        return True
 
 
 def search_caregiver_schedule(tokens):
@@ -223,56 +301,48 @@ def search_caregiver_schedule(tokens):
     : Part 2
     """
     # If no user (Patient or caregiver) is logged in, print “Please login first!”
-    global current_patient
-    global current_caregiver
-    if current_caregiver is None and current_patient is None:
+    session = current_session()
+    if session.current_caregiver is None and session.current_patient is None:
         print('Please login first!')
         return
     
+    # search_caregiver_schedule <date> <date> (or <date>..<date>) shows a whole range at once
+    if len(tokens) == 3 or (len(tokens) == 2 and ".." in tokens[1]):
+        return search_caregiver_schedule_range(tokens[1:] if len(tokens) == 3 else tokens[1].split(".."))
+
     if len(tokens) != 2:
         print('Input Format Incorrect. Please try again!')
         return
 
-    # Check if date in correct format
-    date = tokens[1]
-
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
-    d = datetime.datetime(year, month, day)
-
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
-
-    # create sql statement that gets all available caregivers
-    # for the input date from token, order by username
-    select_available_caregivers = """
-        select Username from Availabilities
-        where Time = %s order by Username
-    """
-    select_available_vaccines = """
-        select Name, Doses from Vaccines
-    """
-
-    # check if cursor execution is correct by testing with data
+    # all available caregivers for the input date ordered by username, then the shifts with their
+    # free slots, then every vaccine; with sites, every site is searched at once and the results merged
+    def fetch():
+        storage = get_storage()
+        return storage.available_caregivers(d), storage.shift_index(d).summary(), storage.vaccines()
     try:
-        cursor.execute(select_available_caregivers, d)
-        result = cursor.fetchall()
-        if not result:
+        # assume input is hyphenated in the format mm-dd-yyyy
+        d = parse_date(tokens[1])
+        results = per_site(fetch)
+        if not any(caregivers or shifts for site, (caregivers, shifts, vaccines) in results):
             print('No available caregivers on this date!')
-            return
-        for row in result:
-            print("Caregiver Name: " + str(row['Username']))
-        cursor.execute(select_available_vaccines)
-        for row in cursor:
-            print(f"Vaccine Name: {str(row['Name'])}, Doses Left: {str(row['Doses'])}")
-    except pymssql.Error as e:
+            return True
+        for site, (caregivers, shifts, vaccines) in results:
+            where = f", Site: {site}" if site is not None else ""
+            for username in caregivers:
+                print("Caregiver Name: " + str(username) + where)
+            for username, (spans, free, earliest) in sorted(shifts.items()):
+                hours = ", ".join(f"{format_time(start)}-{format_time(end)}" for start, end in spans)
+                print(f"Caregiver Name: {username}, Shift: {hours}, Free Slots: {free}"
+                      + (f", Earliest: {format_time(earliest)}" if earliest is not None else "") + where)
+        for site, (caregivers, shifts, vaccines) in results:
+            where = f", Site: {site}" if site is not None else ""
+            for name, doses in vaccines:
+                print(f"Vaccine Name: {str(name)}, Doses Left: {str(doses)}{where}")
+        return True
+    except StorageError as e:
         print("Check Availability Failed")
         print("Db-Error:", e)
-        quit()
+        return
 
     # what is a ValueError? its not in the pymssql doc
     # it is from the datetime module
@@ -295,124 +365,251 @@ def search_caregiver_schedule(tokens):
 
 
 
+def search_caregiver_schedule_range(bounds):
+    # one grouped query for the per-day caregivers of the whole range plus one vaccine snapshot
+    try:
+        if len(bounds) != 2:
+            raise ValueError("Invalid date range")
+        first, last = parse_date_range(bounds)
+
+        def fetch():
+            storage = get_storage()
+            return storage.availability_by_day(first, last), storage.shift_slots_by_day(first, last), storage.vaccines()
+        # with sites, every site is searched at once and the days merged, caregivers named site/username
+        by_day, slots_by_day, vaccines = {}, {}, []
+        for site, (site_days, site_slots, site_vaccines) in per_site(fetch):
+            for day, caregivers in site_days.items():
+                by_day.setdefault(day, []).extend(caregivers if site is None else (f"{site}/{c}" for c in caregivers))
+            for day, slots in site_slots.items():
+                slots_by_day[day] = slots_by_day.get(day, 0) + slots
+            vaccines.extend(site_vaccines if site is None
+                            else ((f"{site}/{name}", doses) for name, doses in site_vaccines))
+    except StorageError as e:
+        print("Check Availability Failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid date range!")
+        return
+    except Exception as e:
+        print("Error occurred when checking availability")
+        print('Please try again!')
+        print("Error:", e)
+        return
+
+    if not by_day and not slots_by_day:
+        print('No available caregivers in this date range!')
+        return True
+    for i in range((last - first).days + 1):
+        day = (first + datetime.timedelta(days=i)).date()
+        caregivers = by_day.get(day, [])
+        # shift slots are counted whether booked or not; search the single date for what is free
+        slots = f", {slots_by_day[day]} shift slot(s)" if day in slots_by_day else ""
+        if caregivers:
+            print(f"{day.strftime('%m-%d-%Y')}: {len(caregivers)} caregiver(s) - {', '.join(caregivers)}{slots}")
+        else:
+            print(f"{day.strftime('%m-%d-%Y')}: 0 caregiver(s){slots}")
+    for name, doses in vaccines:
+        print(f"Vaccine Name: {str(name)}, Doses Left: {str(doses)}")
+    return True
+
+
 def reserve(tokens):
     """
     TODO: Part 2
     """
-    if len(tokens) != 3:
+    # reserve <date> <vaccine> [HH:MM]: the earliest free slot, at or after HH:MM if given
+    if len(tokens) not in (3, 4):
         print('Input Format Incorrect. Please try again!')
         return
     
-    global current_patient, current_caregiver
+    session = current_session()
     # check if patient is logged in
-    if current_patient is None:
+    if session.current_patient is None:
+        print('Please login first!')
+        if session.current_caregiver:
+            print('Please login as a patient!')
+        return
+
+    vaccine = tokens[2]
+    try:
+        # claiming the caregiver, taking the dose and booking happen in one transaction
+        appointment = Appointment(parse_date(tokens[1]), vaccine, session.current_patient.username)
+        not_before = parse_time(tokens[3]) if len(tokens) == 4 else None
+        outcome = appointment.reserve(not_before)
+    # catches all database errors regardless of backend
+    except StorageError as e:
+        print("Reservation Failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid date and time!")
+        return
+    except Exception as e: 
+        print("Error occurred when reserving appointment")
+        print("Error:", e)
+        traceback.print_exc()
+        return
+
+    if outcome == Appointment.NO_CAREGIVER:
+        print('No Caregiver is available!')
+    elif outcome == Appointment.SLOT_LOST:
+        print('All caregivers for this date were just booked, please try again!')
+    elif outcome == Appointment.NO_DOSES:
+        print('Not enough available doses!')
+    else:
+        time = f", Time: {appointment.get_time()}" if appointment.get_time() else ""
+        print(f'Appointment ID: {appointment.get_appointment_id()}, Caregiver username: {appointment.get_caregiver()}'
+              f'{time}')
+        return True
+
+
+def reserve_series(tokens):
+    # reserve_series <date> <vaccine> [HH:MM]: every dose of the vaccine's series, the first on date
+    # and the rest its configured interval apart, all booked or none
+    if len(tokens) not in (3, 4):
+        print('Input Format Incorrect. Please try again!')
+        return
+    session = current_session()
+    if session.current_patient is None:
         print('Please login first!')
-        if current_caregiver:
+        if session.current_caregiver:
             print('Please login as a patient!')
         return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
+    try:
+        d = parse_date(tokens[1])
+        not_before = parse_time(tokens[3]) if len(tokens) == 4 else None
+        vaccine = Vaccine(tokens[2], None).get()
+        if vaccine is None:
+            print('Not enough available doses!')
+            return
+        if vaccine.get_interval_days() is None:
+            print(f'{vaccine.get_vaccine_name()} is given as a single dose, please use reserve!')
+            return
+        outcome, failed, appointments = Appointment.reserve_series(vaccine.series_dates(d), vaccine.get_vaccine_name(),
+                                                                   session.current_patient.username, not_before)
+    except StorageError as e:
+        print("Reservation Failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid date and time!")
+        return
+    except Exception as e:
+        print("Error occurred when reserving appointments")
+        print("Error:", e)
+        traceback.print_exc()
+        return
+
+    if outcome != Appointment.RESERVED:
+        day = failed.strftime('%m-%d-%Y')
+        if outcome == Appointment.NO_CAREGIVER:
+            print(f'No Caregiver is available on {day}, nothing was booked!')
+        elif outcome == Appointment.SLOT_LOST:
+            print(f'All caregivers for {day} were just booked, nothing was booked, please try again!')
+        else:
+            print('Not enough available doses for the whole series, nothing was booked!')
+        return
+    for number, appointment in enumerate(appointments, start=1):
+        time = f", Time: {appointment.get_time()}" if appointment.get_time() else ""
+        print(f"Dose {number}: Appointment ID: {appointment.get_appointment_id()}, "
+              f"Date: {appointment.date.strftime('%m-%d-%Y')}, Caregiver username: {appointment.get_caregiver()}{time}")
+    return True
 
 
-    ## Check if date in correct format
-    date = tokens[1]
-    print('original date: ', date)
-    vaccine = tokens[2]
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# longest date range a single command may cover
+MAX_RANGE_DAYS = 366
+
+# days of appointments on either side of today the forecast command judges usage from, when not given
+FORECAST_DAYS = 28
 
-    ## assume input is hyphenated in the format mm-dd-yyyy
+# slot length of an uploaded shift when the command does not give one
+SLOT_MINUTES = int(os.getenv("SlotMinutes", "15"))
+
+
+def parse_date(date):
+    # assume input is hyphenated in the format mm-dd-yyyy; raises ValueError otherwise
     date_tokens = date.split("-")
+    if len(date_tokens) != 3:
+        raise ValueError(f"Invalid date: {date}")
     month = int(date_tokens[0])
     day = int(date_tokens[1])
     year = int(date_tokens[2])
-    d = datetime.datetime(year, month, day)
-    print('datetime transformed d: ', d)
-
-    select_caregiver_on_date = "select Username from Availabilities where Time = %s order by Username ASC"
-    select_doses_for_vaccine = 'select * from Vaccines where Name = %s and Doses != 0'
-    reserve_appt = """
-        insert into Appointments Values(%s, %s, %s, %s)
-    """ #date, caregiver, patient, vaccine in order
-    select_appointment = "select appointment_id from appointments where caregiver = %s and date = %s"
-    delete_caregiver_avai = "delete from availabilities where username = %s and time = %s"
-    try:
-        # TODO check caregiver availability
-        cursor.execute(select_caregiver_on_date, d)
-        caregiver_result = cursor.fetchone()
-        print('caregiver_result', caregiver_result)
-        if not caregiver_result:
-            print('No Caregiver is available!')
-            return
-        selected_caregiver = caregiver_result['Username']
+    return datetime.datetime(year, month, day)
 
-        # TODO check vaccine availability
-        cursor.execute(select_doses_for_vaccine, vaccine)
-        if not cursor.fetchone():
-            print('Not enough available doses!')
-            return
 
-        # TODO QUES make appointment id- how do you do that?
-        # DONE maintain a database of current ids, auto increment
-        d, selected_caregiver, patient_name, vaccine = str(d), str(selected_caregiver), str(current_patient.username), str(vaccine)
-        print(d, selected_caregiver, patient_name, vaccine)
-        cursor.execute(reserve_appt, (d, selected_caregiver, patient_name, vaccine))
-        cursor.execute(select_appointment, (selected_caregiver, d))
-        appt_id = cursor.fetchone()['appointment_id']
-        print(f'Appointment ID: {appt_id}, Caregiver username: {selected_caregiver}')
-        cursor.execute(delete_caregiver_avai, (selected_caregiver, d))
-        print('Deleted Caregiver availability')
+def parse_date_range(bounds):
+    # [date] or [first, last] -> (first, last), at most MAX_RANGE_DAYS apart; raises ValueError otherwise
+    if len(bounds) not in (1, 2):
+        raise ValueError(f"Invalid date range: {'..'.join(bounds)}")
+    first = parse_date(bounds[0])
+    last = parse_date(bounds[-1])
+    if last < first or (last - first).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"Invalid date range: {'..'.join(bounds)}")
+    return first, last
 
-        # commit to cloud database
-        conn.commit()
 
+def parse_time(value):
+    # "HH:MM" -> minutes after midnight; "24:00" is allowed as the end of a shift
+    parts = value.split(":")
+    if len(parts) != 2 or not all(part.isdigit() for part in parts):
+        raise ValueError(f"Invalid time: {value}")
+    hours, minutes = int(parts[0]), int(parts[1])
+    if minutes >= 60 or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f"Invalid time: {value}")
+    return hours * 60 + minutes
 
 
-    # catches all errors according to pymssql doc
-    except pymssql.Error as e:
-        print("Check Availability Failed")
-        print("Db-Error:", e)
-        quit()
-    
-    # QUES why is this catching errors for valid dates
-    # except ValueError:
-    #     print("Please enter a valid date!")
-    #     return
+def format_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
 
-    except Exception as e: 
-        print("Error occurred when uploading availability")
-        print("Error:", e)
-        print("Error type", type(e))
-        traceback.print_exc()
-        return
+
+def parse_weekdays(pattern):
+    # "mon-fri", "sat,sun", "mon,wed-fri" -> set of datetime.weekday() numbers; ranges may wrap (fri-mon)
+    weekdays = set()
+    for part in pattern.split(","):
+        bounds = part.split("-")
+        if len(bounds) > 2 or any(b[:3] not in WEEKDAYS for b in bounds):
+            raise ValueError(f"Invalid weekday pattern: {pattern}")
+        first = WEEKDAYS.index(bounds[0][:3])
+        last = WEEKDAYS.index(bounds[-1][:3])
+        weekdays.update((first + i) % 7 for i in range((last - first) % 7 + 1))
+    return weekdays
+
+
+def expand_dates(spec, pattern=None):
+    # "mm-dd-yyyy" or "mm-dd-yyyy..mm-dd-yyyy", optionally filtered by a weekday pattern
+    first, last = parse_date_range(spec.split(".."))
+    weekdays = parse_weekdays(pattern) if pattern else set(range(7))
+    days = (first + datetime.timedelta(days=i) for i in range((last - first).days + 1))
+    return [d for d in days if d.weekday() in weekdays]
 
 
 def upload_availability(tokens):
     #  upload_availability <date>
+    #  upload_availability <date>..<date> [weekdays], e.g. 01-01-2027..03-31-2027 mon-fri
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    session = current_session()
+    if session.current_caregiver is None:
         print("Please login as a caregiver first!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    # check 2: the tokens need a date or date range and optionally a weekday pattern
+    if len(tokens) not in (2, 3):
         print("Please try again!")
         return
 
-    date = tokens[1]
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
     try:
-        d = datetime.datetime(year, month, day) # can throw a valueerror
-        current_caregiver.upload_availability(d)
-    except pymssql.Error as e:
+        dates = expand_dates(tokens[1], tokens[2] if len(tokens) == 3 else None)
+        # every date is written in one batched transaction; dates already uploaded are skipped
+        inserted = session.current_caregiver.upload_availabilities(dates)
+    except StorageError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
-        quit()
+        return
     except ValueError:
         print("Please enter a valid date!")
         return
@@ -422,20 +619,131 @@ def upload_availability(tokens):
         print("Error:", e)
         return
     print("Availability uploaded!")
+    if len(dates) != 1 or inserted != 1:
+        print(f"Added {inserted} date(s), skipped {len(dates) - inserted} already uploaded.")
+    if inserted:
+        match_waitlist(dates[0], dates[-1])
+    return True
+
+
+def upload_shift(tokens):
+    #  upload_shift <date> | <date>..<date> <HH:MM-HH:MM> [slot minutes] [weekdays],
+    #  e.g. upload_shift 01-04-2027..01-29-2027 09:00-17:00 15 mon-fri
+    session = current_session()
+    if session.current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+    if len(tokens) not in (3, 4, 5):
+        print("Please try again!")
+        return
+
+    try:
+        hours = tokens[2].split("-")
+        if len(hours) != 2:
+            raise ValueError(f"Invalid shift: {tokens[2]}")
+        start, end = parse_time(hours[0]), parse_time(hours[1])
+        extra = tokens[3:]
+        slot_minutes = int(extra.pop(0)) if extra and extra[0].isdigit() else SLOT_MINUTES
+        if extra[1:]:
+            raise ValueError("Too many arguments")
+        dates = expand_dates(tokens[1], extra[0] if extra else None)
+        # every date is written in one batched transaction; dates with an overlapping shift are skipped
+        inserted = session.current_caregiver.upload_shifts(dates, start, end, slot_minutes)
+    except StorageError as e:
+        print("Upload Shift Failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid date and shift!")
+        return
+    except Exception as e:
+        print("Error occurred when uploading shift")
+        print("Error:", e)
+        return
+    if not dates:
+        print("Shift not uploaded: no date in the range falls on the given weekdays!")
+        return
+    if not inserted:
+        print("Shift not uploaded: every date given already has an overlapping shift!")
+        return
+    print(f"Shift uploaded: {format_time(start)}-{format_time(end)}, {(end - start) // slot_minutes} slot(s) "
+          f"of {slot_minutes} minutes")
+    if len(dates) != 1:
+        print(f"Added {inserted} date(s), skipped {len(dates) - inserted} with an overlapping shift.")
+    match_waitlist(dates[0], dates[-1])
+    return True
 
 
 def cancel(tokens):
     """
-    TODO: Extra Credit
+    : Extra Credit
     """
-    pass
+    # cancel <appointment_id>, by the appointment's patient or caregiver
+    if len(tokens) != 2:
+        print('Input Format Incorrect. Please try again!')
+        return
+    session = current_session()
+    if session.current_caregiver is None and session.current_patient is None:
+        print('Please login first!')
+        return
+    elif session.current_caregiver is not None:
+        table, username = Storage.CAREGIVERS, session.current_caregiver.username
+    else:
+        table, username = Storage.PATIENTS, session.current_patient.username
+
+    try:
+        appointment_id = int(tokens[1])
+        # deleting the appointment, restoring the slot and returning the dose happen in one transaction
+        appointment = Appointment.cancel(appointment_id, table, username)
+    except StorageError as e:
+        print("Cancel Failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print('Please enter a valid appointment ID!')
+        return
+    if appointment is None:
+        print(f'No appointment {appointment_id} found for {username}!')
+        return
+    print(f'Cancelled Appointment ID: {appointment_id}')
+    # the freed slot and dose go to the waitlist first
+    match_waitlist(appointment.date, appointment.date)
+    return True
+
+
+def cancel_day(tokens):
+    # cancel_day <date>: a caregiver cancels every appointment on date and withdraws their availability
+    session = current_session()
+    if session.current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+    if len(tokens) != 2:
+        print('Input Format Incorrect. Please try again!')
+        return
+    try:
+        d = parse_date(tokens[1])
+        cancelled = session.current_caregiver.cancel_day(d)
+    except StorageError as e:
+        print("Cancel Failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    for row in cancelled:
+        print(f"Cancelled Appointment ID: {row['Appointment_id']}, Patient Name: {row['Patient']}")
+    print(f"Cancelled {len(cancelled)} appointment(s) on {d.strftime('%m-%d-%Y')}, availability withdrawn.")
+    if cancelled:
+        # the returned doses may serve waiting patients on other days
+        match_waitlist(*upcoming_days(), list({row['Vaccine'] for row in cancelled}))
+    return True
 
 
 def add_doses(tokens):
     #  add_doses <vaccine> <number>
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    session = current_session()
+    if session.current_caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -445,107 +753,304 @@ def add_doses(tokens):
         return
 
     vaccine_name = tokens[1]
-    doses = int(tokens[2])
-    vaccine = None
+    # a single upsert adds a new (vaccine, doses) entry or increments the existing one server-side
     try:
-        vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
+        Vaccine(vaccine_name, int(tokens[2])).add_to_db()
+    except StorageError as e:
         print("Error occurred when adding doses")
         print("Db-Error:", e)
-        quit()
+        return
+    except ValueError:
+        print("Please enter a valid number of doses!")
+        return
     except Exception as e:
         print("Error occurred when adding doses")
         print("Error:", e)
         return
+    print("Doses updated!")
+    match_waitlist(*upcoming_days(), [vaccine_name])
+    return True
+
+
+def set_interval(tokens):
+    #  set_interval <vaccine> <days>   (days between doses of a two-dose series; 0 makes it single-dose)
+    session = current_session()
+    if session.current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
+    try:
+        days = int(tokens[2])
+        if days < 0:
+            raise ValueError(f"Invalid interval: {days}")
+        updated = Vaccine(tokens[1], None).set_interval(days or None)
+    except StorageError as e:
+        print("Error occurred when setting the dose interval")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid number of days!")
+        return
+    if not updated:
+        print(f"No vaccine named {tokens[1]}, add doses first!")
+        return
+    print(f"Dose interval of {tokens[1]} set to {days} day(s)!" if days else f"{tokens[1]} is now single-dose!")
+    return True
+
+
+def read_doses_csv(lines):
+    # rows of "vaccine,doses" (an optional header row is skipped) -> {vaccine: total doses}
+    doses = {}
+    for line_number, row in enumerate(csv.reader(lines), start=1):
+        if not row or not "".join(row).strip():
+            continue
+        if len(row) != 2:
+            raise ValueError(f"Line {line_number}: expected <vaccine>,<doses>")
+        vaccine_name, count = row[0].strip().lower(), row[1].strip()
+        if line_number == 1 and not count.lstrip("-").isdigit():
+            continue
+        count = int(count)
+        if not vaccine_name or count <= 0:
+            raise ValueError(f"Line {line_number}: doses must be a positive number for a named vaccine")
+        doses[vaccine_name] = doses.get(vaccine_name, 0) + count
+    return doses
+
 
-    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
-    # else, update the existing entry by adding the new doses
-    if vaccine is None:
-        vaccine = Vaccine(vaccine_name, doses)
+def read_stdin_lines():
+    # CSV lines from stdin up to a blank line or end of input
+    while True:
         try:
-            vaccine.save_to_db()
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
+            line = input()
+        except EOFError:
             return
-    else:
-        # if the vaccine is not null, meaning that the vaccine already exists in our table
+        if not line.strip():
+            return
+        yield line
+
+
+def import_doses(tokens):
+    #  import_doses <file>   (CSV of vaccine,doses rows; "-" reads them from stdin until a blank line)
+    #  check 1: check if the current logged-in user is a caregiver
+    session = current_session()
+    if session.current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    #  check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    path = tokens[1]
+    if path == "-" and current_session() is not console_session:
+        print("Reading doses from stdin is only available on the console!")
+        return
+    try:
+        if path == "-":
+            doses = read_doses_csv(read_stdin_lines())
+        else:
+            with open(path, newline="") as f:
+                doses = read_doses_csv(f)
+        # the whole shipment is applied as one upsert batch in one transaction
+        Vaccine.add_doses_bulk(doses)
+    except StorageError as e:
+        print("Error occurred when importing doses")
+        print("Db-Error:", e)
+        return
+    except OSError as e:
+        print("Could not read dose file!")
+        print("Error:", e)
+        return
+    except Exception as e:
+        print("Error occurred when importing doses")
+        print("Error:", e)
+        return
+    print(f"Doses updated for {len(doses)} vaccine(s), {sum(doses.values())} dose(s) in total!")
+    match_waitlist(*upcoming_days(), list(doses))
+    return True
+
+
+def forecast(tokens):
+    #  forecast [days]: when each vaccine runs out at the rate it is booked, judged from the appointments of the
+    #  last and next <days> days (patients book ahead), flagging vaccines that run out while caregivers are open
+    session = current_session()
+    if session.current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+    if len(tokens) > 2:
+        print("Please try again!")
+        return
+    try:
+        days = int(tokens[1]) if len(tokens) == 2 else FORECAST_DAYS
+        if not 0 < days <= MAX_RANGE_DAYS:
+            raise ValueError(f"Invalid number of days: {days}")
+        today = datetime.date.today()
+        first = today - datetime.timedelta(days=days)
+        last = today + datetime.timedelta(days=days - 1)
+        storage = get_storage()
+        # one grouped query for the usage of every vaccine, then the open days of the horizon
+        usage = storage.dose_usage(first, last)
+        stock = dict(storage.vaccines())
+        open_days = sorted(set(storage.availability_by_day(today, last)) | set(storage.shift_slots_by_day(today, last)))
+    except StorageError as e:
+        print("Forecast Failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid number of days!")
+        return
+
+    projections = forecast_depletion(usage, stock, 2 * days, today)
+    if not projections:
+        print("No vaccines in stock or booked!")
+    for name, (rate, peak, depletion) in projections.items():
+        line = f"Vaccine Name: {name}, Doses Left: {stock.get(name, 0)}, Daily Use: {rate:.2f}, Busiest Day: {peak}"
+        if depletion is None or depletion > last:
+            print(f"{line}, Runs Out: not within {days} day(s)")
+            continue
+        line += f", Runs Out: {depletion.strftime('%m-%d-%Y')}"
+        reopening = next((d for d in open_days if d >= depletion), None)
+        if reopening is not None:
+            line += f"  <-- before open day {reopening.strftime('%m-%d-%Y')}"
+        print(line)
+    return True
+
+
+def upcoming_days():
+    # the dates newly added doses can still be booked on
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    return today, today + datetime.timedelta(days=MAX_RANGE_DAYS - 1)
+
+
+def match_waitlist(first, last, vaccines=None):
+    # book waiting patients into capacity that was just added; the caller's change stands either way
+    try:
+        booked = Waitlist.match(first, last, vaccines)
+    except StorageError as e:
+        print("Waitlist matching failed, it runs again with the next upload or doses added")
+        print("Db-Error:", e)
+        return
+    if booked:
+        print(f"Booked {len(booked)} waitlisted appointment(s)!")
+
+
+def waitlist(tokens):
+    #  waitlist <date> <vaccine> | waitlist <date>..<date> <vaccine>   (book the first opening in the range)
+    #  waitlist   (show your waiting requests)
+    session = current_session()
+    if session.current_patient is None:
+        print('Please login as a patient first!')
+        return
+    if len(tokens) == 1:
         try:
-            vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
+            requests = Waitlist.requests_of(session.current_patient.username)
+        except StorageError as e:
+            print("Please try again!")
             print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
             return
-    print("Doses updated!")
+        if not requests:
+            print("You are not on the waitlist.")
+        for request in requests:
+            print(f"Request ID: {request.get_request_id()}, Vaccine Name: {request.vaccine_name}, "
+                  f"Dates: {request.first.strftime('%m-%d-%Y')}..{request.last.strftime('%m-%d-%Y')}")
+        return True
+    if len(tokens) != 3:
+        print('Input Format Incorrect. Please try again!')
+        return
+
+    try:
+        first, last = parse_date_range(tokens[1].split(".."))
+        request = Waitlist(session.current_patient.username, tokens[2], first, last)
+        request.save_to_db()
+    except StorageError as e:
+        print("Joining the waitlist failed")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        print("Please enter a valid date range!")
+        return
+    print(f"Added to the waitlist, Request ID: {request.get_request_id()}")
+    # an opening may already exist; earlier requests for it still go first
+    match_waitlist(first, last, [request.vaccine_name])
+    return True
+
+
+def parse_appointment_filters(tokens):
+    # [--after ID] [--limit N] [--from DATE] [--to DATE] -> keyword arguments for iter_appointments
+    options = {"--after": "after", "--limit": "limit", "--from": "first", "--to": "last"}
+    if len(tokens) % 2 != 0:
+        raise ValueError("Options take one value each")
+    filters = {}
+    for flag, value in zip(tokens[::2], tokens[1::2]):
+        if flag not in options or options[flag] in filters:
+            raise ValueError(f"Unknown or repeated option: {flag}")
+        if flag in ("--after", "--limit"):
+            value = int(value)
+            if value < 0 or (flag == "--limit" and value == 0):
+                raise ValueError(f"Invalid value for {flag}")
+        else:
+            value = parse_date(value)
+        filters[options[flag]] = value
+    return filters
 
 
 def show_appointments(tokens):
     '''
     : Part 2
     '''
-    if len(tokens) != 1:
+    # show_appointments [--after ID] [--limit N] [--from DATE] [--to DATE]
+    try:
+        filters = parse_appointment_filters(tokens[1:])
+    except ValueError:
         print('Input Format Incorrect. Please try again!')
         return
     # check if patient/caregiver logged in
-    global current_caregiver, current_patient
+    session = current_session()
     user1 = ''
     username = ''
-    select_scheduled_appt = """"""
-    select_scheduled_appt_patient = """
-        select Appointment_id, Vaccine, Date, Caregiver
-        from Appointments
-        where Patient = %s
-        order by Appointment_id
-    """
-    select_scheduled_appt_caregiver = """
-        select Appointment_id, Vaccine, Date, Patient
-        from Appointments
-        where Caregiver = %s
-        order by Appointment_id
-    """
-    if current_caregiver is None and current_patient is None:
+    table = ''
+    if session.current_caregiver is None and session.current_patient is None:
         print('Please login first!')
         return
-    elif current_caregiver is not None:
-        select_scheduled_appt = select_scheduled_appt_caregiver
-        username = current_caregiver.username
+    elif session.current_caregiver is not None:
+        table = Storage.CAREGIVERS
+        username = session.current_caregiver.username
         user1 = 'Patient'
     else:
-        select_scheduled_appt = select_scheduled_appt_patient
-        username = current_patient.username
+        table = Storage.PATIENTS
+        username = session.current_patient.username
         user1 = 'Caregiver'
 
-    # output scheduled appointments for current user ordered by appointment_id
-    #
-
+    # stream scheduled appointments for current user ordered by appointment_id;
+    # one row past the limit tells us whether to point at the next page
+    limit = filters.pop("limit", None)
+    shown = 0
+    last_id = None
     try:
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_scheduled_appt, username)
-        result = cursor.fetchall()
-        for row in result:
-            print(f"Appointment_ID: {str(row['Appointment_id'])}, Vaccine Name: {str(row['Vaccine'])}, Date: {str(row['Date'])}, {user1} Name: {str(row[user1])}")
+        rows = get_storage().iter_appointments(table, username, limit=None if limit is None else limit + 1,
+                                               **filters)
+        for row in rows:
+            if shown == limit:
+                print(f"More appointments: show_appointments --after {last_id} --limit {limit}")
+                break
+            time = f", Time: {format_time(row['Slot'])}" if row['Slot'] is not None else ""
+            print(f"Appointment_ID: {str(row['Appointment_id'])}, Vaccine Name: {str(row['Vaccine'])}, Date: {str(row['Date'])}{time}, {user1} Name: {str(row[user1])}")
+            shown += 1
+            last_id = row['Appointment_id']
     # what exception should I do to catch all errors
-    except pymssql.Error as e:
+    except StorageError as e:
         print("Please try again!")
         print("Error: ", e)
         traceback.print_exc()
         return
     except Exception as e:
-        print("Error occurred when adding doses")
+        print("Error occurred when showing appointments")
         print("Error:", e)
         traceback.print_exc()
         return
-
+    return True
 
 
 def logout(tokens):
@@ -555,35 +1060,238 @@ def logout(tokens):
     if len(tokens) != 1:
         print('Input Format Incorrect. Please try again!')
         return
-    global current_caregiver
-    global current_patient
-    if current_caregiver is None and current_patient is None:
+    session = current_session()
+    if session.current_caregiver is None and session.current_patient is None:
         print('Please login first!')
         return
-    elif current_caregiver is not None:
-        current_caregiver = None
+    elif session.current_caregiver is not None:
+        session.current_caregiver = None
     else:
-        current_patient = None
+        session.current_patient = None
+    session.site = None
     print('Successfully logged out!')
+    return True
+
+
+def switch_site(tokens):
+    #  site                  (list the sites and the one this session uses)
+    #  site <name>           (patients: book, cancel and wait at another site from now on)
+    router = get_router()
+    session = current_session()
+    if len(tokens) == 1:
+        if not router.sharded:
+            print("No sites configured, every clinic shares one database.")
+            return True
+        for name in router.sites:
+            print(f"Site: {name}{'  <-- current' if name == router.current() else ''}")
+        return True
+    if len(tokens) != 2:
+        print('Input Format Incorrect. Please try again!')
+        return
+    if session.current_patient is None:
+        # caregivers work at the site they were created at
+        print('Please login as a patient first!')
+        return
+    try:
+        name = router.check(tokens[1])
+        with router.use(name):
+            # appointments reference the patient's account, so it is copied to a site before first use there
+            session.current_patient.copy_to_db()
+    except StorageError as e:
+        print("Switching site failed")
+        print("Db-Error:", e)
+        return
+    except ValueError as e:
+        print(e)
+        return
+    session.site = name
+    print(f"Now at site: {name}")
+    return True
 
 
-def start():
-    stop = False
+def stats(tokens):
+    # stats: per-command latency, statements and connections, cache hit rates and slow statements
+    if len(tokens) != 1:
+        print('Input Format Incorrect. Please try again!')
+        return
+    if not metrics.enabled:
+        print("Metrics are disabled, start with Metrics=1 to collect them.")
+        return
+    for row in metrics.summary():
+        print(f"{row['command']}: {row['count']} run(s), mean {row['mean_ms']} ms, p50 <= {row['p50_ms']:g} ms, "
+              f"p95 <= {row['p95_ms']:g} ms, p99 <= {row['p99_ms']:g} ms, "
+              f"{row['queries_per_command']} queries/command, {row['connections_opened']} connection(s) opened")
+    for site, site_stats in per_site(lambda: get_storage().cache_stats()):
+        where = f" at {site}" if site is not None else ""
+        for cache, cache_stats in site_stats.items():
+            print(f"Cache {cache}{where}: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                  f"{cache_stats['size']} entries")
+    for site, resilience in per_site(lambda: get_storage().resilience_stats()):
+        where = f" at {site}" if site is not None else ""
+        retries = ", ".join(f"{count} {kind}" for kind, count in sorted(resilience['retries'].items())) or "none"
+        print(f"Database retries{where}: {retries}; {resilience['gave_up']} call(s) gave up; circuit breaker "
+              f"{resilience['state']}, opened {resilience['opened']} time(s), {resilience['rejected']} call(s) rejected")
+    reads = {}
+    for labels, count in ConnectionManager.read_routes().items():
+        labels = dict(labels)
+        reads.setdefault(labels.get("site"), {})[labels["route"]] = count
+    for site, routes in reads.items():
+        where = f" at {site}" if site is not None else ""
+        print(f"Replica reads{where}: {routes.get('replica', 0)} on the replica, {routes.get('pinned', 0)} on the "
+              f"primary after a write, {routes.get('lagging', 0)} while it lagged, "
+              f"{routes.get('unavailable', 0)} while it was unavailable")
+    for query in metrics.slow_queries:
+        print(f"Slow query in {query['command']} ({query['seconds']}s): {query['sql']} {query['params']}")
+    try:
+        metrics.export()
+    except OSError as e:
+        print("Could not write metrics file!")
+        print("Error:", e)
+        return
+    return True
+
+
+def check_schema(tokens):
+    # check_schema: schema version and the plan of every hot statement; fails if any of them scans
+    if len(tokens) != 1:
+        print('Input Format Incorrect. Please try again!')
+        return
+    schema = Schema(get_storage())
+    try:
+        version = schema.version()
+        report = schema.check()
+    except StorageError as e:
+        print("Schema check failed")
+        print("Db-Error:", e)
+        return
+    print(f"Schema version: {version} (latest {schema.latest})")
+    for name, plan, scans in report:
+        print(f"{name}:{'  <-- SCAN' if scans else ''}")
+        for line in plan:
+            print(f"    {line.strip()}")
+    if version < schema.latest or any(scans for name, plan, scans in report):
+        return
+    return True
+
+
+# every operation run_command understands, used to label metrics
+COMMANDS = ("create_patient", "create_caregiver", "login_patient", "login_caregiver", "search_caregiver_schedule",
+            "reserve", "reserve_series", "upload_availability", "upload_shift", "cancel", "cancel_day", "add_doses",
+            "set_interval", "import_doses", "forecast", "show_appointments", "logout", "stats", "check_schema",
+            "waitlist", "site", "quit")
+
+# commands that write; consecutive ones share a transaction in script mode
+WRITE_COMMANDS = ("create_patient", "create_caregiver", "reserve", "reserve_series", "upload_availability",
+                  "upload_shift", "cancel", "cancel_day", "add_doses", "set_interval", "import_doses", "waitlist")
+
+# what execute() returns for the quit command
+QUIT = "quit"
+
+
+def print_menu():
     print()
     print(" *** Please enter one of the following commands *** ")
-    print("> create_patient <username> <password>")  # //TODO: implement create_patient (Part 1)
-    print("> create_caregiver <username> <password>")
+    print("> create_patient <username> <password> [site]")  # //TODO: implement create_patient (Part 1)
+    print("> create_caregiver <username> <password> [site]")
     print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
     print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
-    print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
-    print("> upload_availability <date>")
-    print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
+    print("> search_caregiver_schedule <date> [<end date>]")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> reserve <date> <vaccine> [HH:MM]")  # // TODO: implement reserve (Part 2)
+    print("> reserve_series <date> <vaccine> [HH:MM]")
+    print("> upload_availability <date> | <date>..<date> [mon-fri]")
+    print("> upload_shift <date> | <date>..<date> <HH:MM-HH:MM> [slot minutes] [mon-fri]")
+    print("> cancel <appointment_id>")
+    print("> cancel_day <date>")
     print("> add_doses <vaccine> <number>")
-    print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
+    print("> set_interval <vaccine> <days>")
+    print("> import_doses <csv file>")
+    print("> forecast [days]")
+    print("> waitlist [<date> | <date>..<date> <vaccine>]")
+    print("> show_appointments [--after <appointment_id>] [--limit <n>] [--from <date>] [--to <date>]")  # // TODO: implement show_appointments (Part 2)
+    print("> site [<name>]")
     print("> logout")  # // TODO: implement logout (Part 2)
+    print("> stats")
+    print("> check_schema")
     print("> Quit")
     print()
+
+
+def run_command(response):
+    # runs one command line for the current session; returns False once the user quits
+    return execute(response) != QUIT
+
+
+def execute(response):
+    # runs one command line for the current session; returns True if it succeeded and QUIT if the user quits
+    notlowered_response = response
+    response = response.lower()
+    tokens = response.split(" ")
+    if len(tokens) == 0:
+        ValueError("Please try again!")
+        return
+    operation = tokens[0]
+    # unknown operations share one label so typos cannot grow the metrics without bound
+    # and the session's site routes every get_storage() of the command to that site's database;
+    # its write times keep the command's reads off a replica that may not have its writes yet
+    session = current_session()
+    with metrics.command(operation if operation in COMMANDS else "invalid"), get_router().use(session.site), \
+            ConnectionManager.read_your_writes(session.writes):
+        return dispatch(operation, tokens, notlowered_response)
+
+
+def dispatch(operation, tokens, notlowered_response):
+    if operation == "create_patient":
+        return create_patient(notlowered_response.split(" "))
+    elif operation == "create_caregiver":
+        return create_caregiver(notlowered_response.split(" "))
+    elif operation == "login_patient":
+        return login_patient(notlowered_response.split(" "))
+    elif operation == "login_caregiver":
+        return login_caregiver(notlowered_response.split(" "))
+    elif operation == "search_caregiver_schedule":
+        return search_caregiver_schedule(tokens)
+    elif operation == "reserve":
+        return reserve(tokens)
+    elif operation == "reserve_series":
+        return reserve_series(tokens)
+    elif operation == "upload_availability":
+        return upload_availability(tokens)
+    elif operation == "upload_shift":
+        return upload_shift(tokens)
+    elif operation == "cancel":
+        return cancel(tokens)
+    elif operation == "cancel_day":
+        return cancel_day(tokens)
+    elif operation == "add_doses":
+        return add_doses(tokens)
+    elif operation == "set_interval":
+        return set_interval(tokens)
+    elif operation == "import_doses":
+        return import_doses(notlowered_response.split(" "))
+    elif operation == "forecast":
+        return forecast(tokens)
+    elif operation == "waitlist":
+        return waitlist(tokens)
+    elif operation == "show_appointments":
+        return show_appointments(tokens)
+    elif operation == "site":
+        return switch_site(tokens)
+    elif operation == "logout":
+        return logout(tokens)
+    elif operation == "stats":
+        return stats(tokens)
+    elif operation == "check_schema":
+        return check_schema(tokens)
+    elif operation == "quit":
+        print("Bye!")
+        return QUIT
+    else:
+        print("Invalid operation name!")
+
+
+def start():
+    stop = False
+    print_menu()
     while not stop:
         response = ""
         print("> ", end='')
@@ -593,43 +1301,106 @@ def start():
         except ValueError:
             print("Please try again!")
             break
-        notlowered_response = response
-        response = response.lower()
-        tokens = response.split(" ")
-        if len(tokens) == 0:
-            ValueError("Please try again!")
+        stop = not run_command(response)
+
+
+def run_script(lines, out, group_size=100, stop_on_error=False):
+    """
+    Run commands non-interactively, one per line exactly as typed on the
+    console (blank lines and # comments are skipped), and write one JSON
+    result per command to out. Consecutive writes share one connection and
+    one transaction of up to group_size commands; their results are written
+    once the group commits. A group writes at one site: a write bound for
+    another site commits the group and starts a new one there. A command that
+    raises is reported as failed with its error and the script goes on.
+    Returns the number of failed commands.
+    """
+    router = get_router()
+    group = contextlib.ExitStack()
+    group_storage = None
+    pending = []
+    failures = 0
+
+    def write_site(line):
+        # accounts are created at the site they name (the home site by default), everything else is
+        # written at the session's site; an unknown site fails the command before it writes anywhere
+        tokens = line.split(" ")
+        if tokens[0].lower() in ("create_patient", "create_caregiver"):
+            named = tokens[3].lower() if len(tokens) == 4 else None
+            return named if named in router.sites else router.home
+        return current_session().site
+
+    def end_group():
+        # commit the open write group and report its commands
+        nonlocal failures
+        try:
+            group.close()
+        except StorageError as e:
+            for result in pending:
+                result.update(ok=False, error=f"Db-Error: {e}")
+        for result in pending:
+            failures += not result["ok"]
+            out.write(json.dumps(result) + "\n")
+        out.flush()
+        pending.clear()
+
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.lstrip().startswith("#"):
             continue
-        operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(notlowered_response.split(" "))
-        elif operation == "create_caregiver":
-            create_caregiver(notlowered_response.split(" "))
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == cancel:
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
-        elif operation == "quit":
-            print("Bye!")
-            stop = True
+        operation = line.split(" ")[0].lower()
+        if operation in WRITE_COMMANDS:
+            storage = get_storage(write_site(line))
+            if pending and storage is not group_storage:
+                end_group()
+            if not pending:
+                group_storage = storage
+                group.enter_context(storage.batch())
+        elif pending:
+            end_group()
+
+        output = io.StringIO()
+        error = None
+        try:
+            with contextlib.redirect_stdout(output):
+                result = execute(line)
+        except Exception as e:
+            # a command that raises fails alone: a write's savepoint already undid its changes
+            result, error = None, f"Error: {e}"
+        record = {"line": line_number, "command": operation, "ok": result is not None,
+                  "output": output.getvalue().splitlines()}
+        if error is not None:
+            record["error"] = error
+        if operation in WRITE_COMMANDS:
+            pending.append(record)
+            if len(pending) >= group_size:
+                end_group()
         else:
-            print("Invalid operation name!")
+            failures += not record["ok"]
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+        if result == QUIT or (stop_on_error and result is None):
+            break
+    end_group()
+    return failures
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="COVID-19 vaccine reservation scheduler.")
+    parser.add_argument("--script", metavar="FILE",
+                        help="run the commands in FILE ('-' for stdin) and print one JSON result per line")
+    parser.add_argument("--group-size", type=int, default=int(os.getenv("ScriptGroupSize", "100")),
+                        help="most consecutive write commands committed together in script mode")
+    parser.add_argument("--stop-on-error", action="store_true", help="stop the script at the first failed command")
+    args = parser.parse_args()
+
+    if args.script is not None:
+        # readline() rather than iterating the stream, so "import_doses -" can read the lines that follow it
+        script = sys.stdin if args.script == "-" else open(args.script)
+        with script:
+            failed = run_script(iter(script.readline, ""), sys.stdout, max(args.group_size, 1), args.stop_on_error)
+        sys.exit(1 if failed else 0)
+
     '''
     // pre-define the three types of authorized vaccines
     // note: it's a poor practice to hard-code these values, but we will do this ]
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import Scheduler
+
+
+class SessionStdout:
+    """
+    Stand-in for sys.stdout that routes print() from a command to the output
+    buffer of the session running it, so the command functions keep printing
+    as they do on the console.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _target(self):
+        out = Scheduler.current_session().out
+        return self.stream if out is None else out
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class SchedulerServer:
+    """
+    Line-protocol server: every TCP connection gets its own Scheduler.Session
+    and sends one command per line, exactly as typed on the console. Commands
+    run on a bounded thread pool so blocking database calls of one session
+    never stall the event loop or the other sessions.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, workers=32):
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler")
+
+    async def handle(self, reader, writer):
+        session = Scheduler.Session()
+        loop = asyncio.get_running_loop()
+        try:
+            output, keep_going = await loop.run_in_executor(self.executor, self._run, session, None)
+            while True:
+                writer.write(output)
+                await writer.drain()
+                if not keep_going:
+                    break
+                line = await reader.readline()
+                if not line:
+                    break
+                response = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                output, keep_going = await loop.run_in_executor(self.executor, self._run, session, response)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                # wait for the transport to be released; a client that reset the connection has nothing left
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    def _run(session, response):
+        # runs on a worker thread; returns the bytes to send back and whether the session goes on
+        session.out = io.StringIO()
+        with Scheduler.use_session(session):
+            if response is None:
+                Scheduler.print_menu()
+                keep_going = True
+            else:
+                try:
+                    keep_going = Scheduler.run_command(response)
+                except Exception as e:
+                    # a command that raises fails alone; the client gets the error and the session goes on
+                    print("Error occurred when running the command")
+                    print("Error:", e)
+                    keep_going = True
+            if keep_going:
+                print("> ", end='')
+        return session.out.getvalue().encode("utf-8"), keep_going
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        async with server:
+            print(f"Scheduler server listening on {self.host}:{self.port}", file=sys.__stdout__, flush=True)
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve scheduler sessions over TCP.")
+    parser.add_argument("--host", default=os.getenv("ServerHost", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("ServerPort", "8765")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("ServerWorkers", "32")),
+                        help="threads running blocking database calls")
+    args = parser.parse_args()
+
+    sys.stdout = SessionStdout(sys.stdout)
+    server = SchedulerServer(args.host, args.port, args.workers)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import random
+import threading
+
+
+class AssignmentStrategy:
+    """
+    Decides which of the caregivers available on a date reserve() books. A
+    strategy supplies the ORDER BY over the date's Availabilities rows;
+    reserve() books the first row it can lock, skipping rows other reservers
+    hold, so strategies that spread the picks also spread lock contention.
+    For shift slots it orders the caregivers free at the same time instead.
+    """
+
+    name = None
+
+    def order_by(self, storage, d):
+        # (ORDER BY expression over Availabilities, its parameters)
+        raise NotImplementedError
+
+    def order(self, storage, d, caregivers):
+        # the caregivers, most preferred first, in the same order order_by() would give their rows
+        raise NotImplementedError
+
+    def assigned(self, caregiver, d):
+        # called after a booking commits
+        pass
+
+
+class Alphabetical(AssignmentStrategy):
+    """First available username, the original behaviour."""
+
+    name = "alphabetical"
+
+    def order_by(self, storage, d):
+        return "Availabilities.Username", ()
+
+    def order(self, storage, d, caregivers):
+        return sorted(caregivers)
+
+
+class LeastBooked(AssignmentStrategy):
+    """Caregiver with the fewest bookings in the week of the date, by the CaregiverLoad counters."""
+
+    name = "least_booked"
+
+    def order_by(self, storage, d):
+        booked = """
+            COALESCE((SELECT Booked FROM CaregiverLoad
+                      WHERE CaregiverLoad.Username = Availabilities.Username AND CaregiverLoad.Week = %s), 0),
+            Availabilities.Username
+        """
+        return booked, (storage.week_of(d),)
+
+    def order(self, storage, d, caregivers):
+        booked = storage.weekly_bookings(d, caregivers)
+        return sorted(caregivers, key=lambda caregiver: (booked.get(caregiver, 0), caregiver))
+
+
+class RoundRobin(AssignmentStrategy):
+    """Next username after the one this process booked last, wrapping around."""
+
+    name = "round_robin"
+
+    def __init__(self):
+        self.last = ""
+        self._lock = threading.Lock()
+
+    def order_by(self, storage, d):
+        with self._lock:
+            last = self.last
+        return "CASE WHEN Availabilities.Username > %s THEN 0 ELSE 1 END, Availabilities.Username", (last,)
+
+    def order(self, storage, d, caregivers):
+        with self._lock:
+            last = self.last
+        return sorted(caregivers, key=lambda caregiver: (caregiver <= last, caregiver))
+
+    def assigned(self, caregiver, d):
+        with self._lock:
+            self.last = caregiver
+
+
+class RandomRotation(AssignmentStrategy):
+    """Usernames from a random available caregiver onwards, wrapping around; reproducible with a seed."""
+
+    name = "random"
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def order_by(self, storage, d):
+        # the candidates come from the availability cache, so picking a start costs no extra query
+        candidates = storage.available_caregivers(d)
+        with self._lock:
+            start = self.random.choice(candidates) if candidates else ""
+        return "CASE WHEN Availabilities.Username >= %s THEN 0 ELSE 1 END, Availabilities.Username", (start,)
+
+    def order(self, storage, d, caregivers):
+        caregivers = sorted(caregivers)
+        with self._lock:
+            start = self.random.choice(caregivers) if caregivers else ""
+        return sorted(caregivers, key=lambda caregiver: (caregiver < start, caregiver))
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (Alphabetical, LeastBooked, RoundRobin, RandomRotation)}
+
+
+def get_strategy(name, seed=None):
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown assignment strategy: {name} (choose from {', '.join(STRATEGIES)})")
+    if name == RandomRotation.name:
+        return RandomRotation(seed)
+    return STRATEGIES[name]()
@@ -0,0 +1,294 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from db.ConnectionPool import ConnectionPool, PoolTimeout
+from util.Metrics import metrics
+
+
+class ReadYourWrites:
+    """
+    When one session last wrote to each site. After a write its reads there
+    stay on the primary for ReplicaMaxLag seconds, by which time a replica
+    within that tolerance has applied the write.
+    """
+
+    __slots__ = ("_until",)
+
+    def __init__(self):
+        self._until = {}
+
+    def wrote(self, site, window):
+        self._until[site] = time.monotonic() + window
+
+    def pinned(self, site):
+        return time.monotonic() < self._until.get(site, 0.0)
+
+
+class ConnectionManager:
+    """
+    Hands out connections from one process-wide pool.
+
+    create_connection() checks a connection out of the shared pool and
+    close_connection() returns it, so call sites keep their usual
+    create/close pattern but no longer pay a TCP+TLS+login handshake per call.
+    A ConnectionManager can also be used as a context manager:
+
+        with ConnectionManager() as conn:
+            ...
+
+    The backend is chosen with the Backend environment variable: "mssql"
+    (default, Azure SQL through pymssql) or "sqlite" (an embedded database at
+    SqlitePath, which may be ":memory:").
+
+    With sites configured (see db.SiteRouter) every site is its own database
+    with its own pool: ConnectionManager("north") reads each setting from
+    <setting>_north (e.g. Server_north, SqlitePath_north) when it is set and
+    from the shared <setting> otherwise.
+
+    A read replica is configured with ReplicaServer (or ReplicaSqlitePath
+    on SQLite); its other settings are Replica<setting>, falling back to the
+    primary's. ConnectionManager(read_only=True) then hands out replica
+    connections, except in these cases:
+    - the current session wrote to the site in the last ReplicaMaxLag
+      seconds (read-your-writes);
+    - the replica is more than ReplicaMaxLag seconds behind, measured every
+      ReplicaCheckInterval seconds;
+    - the replica cannot be reached.
+    In those cases the connection comes from the primary.
+    """
+
+    # one pool per (site, replica?), the unsited database under None
+    _pools = {}
+    _pool_lock = threading.Lock()
+    # per site, where reads go ("replica", "lagging" or "unavailable") and until when that holds
+    _replica_routes = {}
+    # read-only checkouts per (site, route), where route is "replica" or why the read stayed on the primary
+    _read_routes = {}
+    _route_lock = threading.Lock()
+    # the ReadYourWrites of the session running in this context; writes outside any session (a script's
+    # write group, a bulk load) pin every session's reads
+    _writes = contextvars.ContextVar("read_your_writes", default=None)
+    _process_writes = ReadYourWrites()
+    # per site, (replica configured?, ReplicaMaxLag), read from the environment once: wrote() runs on every commit
+    _replica_settings = {}
+
+    def __init__(self, site=None, read_only=False, replica=False):
+        self.site = site
+        # read_only: the connection may come from the replica; replica: it always does (pool() uses this)
+        self.read_only = read_only
+        self.replica = replica
+        self.backend = self._setting("Backend", "mssql").lower()
+        if self.backend == "sqlite":
+            self.sqlite_path = self._setting("SqlitePath", "scheduler.db")
+        elif self.backend == "mssql":
+            server = self._setting("Server")
+            if server is None:
+                where = "" if self.site is None else f" (or Server_{self.site})"
+                raise ValueError(f"Server{where} is not set: the mssql backend needs the Azure SQL server name")
+            self.server_name = server + ".database.windows.net"
+            self.db_name = self._setting("DBName")
+            self.user = self._setting("UserID")
+            self.password = self._setting("Password")
+        else:
+            raise ValueError(f"Unknown backend: {self.backend}")
+        self.conn = None
+        self._pool = None
+
+    def _setting(self, name, default=None):
+        for key in (f"Replica{name}", name) if self.replica else (name,):
+            if self.site is not None:
+                value = os.getenv(f"{key}_{self.site}")
+                if value is not None:
+                    return value
+            value = os.getenv(key)
+            if value is not None:
+                return value
+        return default
+
+    def replica_configured(self):
+        return ConnectionManager._replica_settings_of(self.site)[0]
+
+    def replica_max_lag(self):
+        return ConnectionManager._replica_settings_of(self.site)[1]
+
+    @classmethod
+    def _replica_settings_of(cls, site):
+        settings = cls._replica_settings.get(site)
+        if settings is None:
+            cm = ConnectionManager(site)
+            key = "ReplicaSqlitePath" if cm.backend == "sqlite" else "ReplicaServer"
+            settings = (cm._setting(key) is not None, float(cm._setting("ReplicaMaxLag", "5")))
+            with cls._route_lock:
+                cls._replica_settings[site] = settings
+        return settings
+
+    def driver(self):
+        if self.backend == "sqlite":
+            import sqlite3
+            return sqlite3
+        import pymssql
+        return pymssql
+
+    def connect(self):
+        if metrics.enabled:
+            metrics.record_connection()
+        if self.backend == "sqlite":
+            return self._connect_sqlite()
+        return self.driver().connect(server=self.server_name, user=self.user, password=self.password,
+                                     database=self.db_name)
+
+    def _connect_sqlite(self):
+        sqlite3 = self.driver()
+        if self.replica:
+            # read-only, so a missing replica fails to open instead of being created empty
+            conn = sqlite3.connect(f"file:{self.sqlite_path}?mode=ro", timeout=30, isolation_level=None,
+                                   check_same_thread=False, uri=True)
+            conn.row_factory = sqlite3.Row
+            return conn
+        # autocommit mode: Storage issues BEGIN IMMEDIATE itself for write transactions
+        conn = sqlite3.connect(self.sqlite_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        if self.sqlite_path != ":memory:":
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def pool_settings(self):
+        settings = dict(
+            min_size=int(self._setting("PoolMinSize", "1")),
+            max_size=int(self._setting("PoolMaxSize", "10")),
+            max_idle=float(self._setting("PoolMaxIdle", "300")),
+            check_after=float(self._setting("PoolCheckAfter", "30")),
+            checkout_timeout=float(self._setting("PoolTimeout", "30")),
+        )
+        if self.backend == "sqlite" and self.sqlite_path == ":memory:":
+            # every connection to :memory: is a separate database, so keep exactly one alive
+            settings.update(min_size=1, max_size=1, max_idle=float("inf"))
+        return settings
+
+    @classmethod
+    def pool(cls, site=None, replica=False):
+        pool = cls._pools.get((site, replica))
+        if pool is None:
+            with cls._pool_lock:
+                pool = cls._pools.get((site, replica))
+                if pool is None:
+                    cm = ConnectionManager(site, replica=replica)
+                    pool = ConnectionPool(cm.connect, **cm.pool_settings())
+                    pool.warm()
+                    cls._pools[(site, replica)] = pool
+        return pool
+
+    @classmethod
+    def close_pool(cls):
+        # closes every site's pools
+        with cls._pool_lock:
+            for pool in cls._pools.values():
+                pool.close()
+            cls._pools = {}
+        with cls._route_lock:
+            cls._replica_routes = {}
+
+    @classmethod
+    @contextmanager
+    def read_your_writes(cls, writes):
+        """Attribute the writes inside the block to writes, a session's ReadYourWrites."""
+        token = cls._writes.set(writes)
+        try:
+            yield writes
+        finally:
+            cls._writes.reset(token)
+
+    @classmethod
+    def wrote(cls, site=None):
+        """Record a committed write to site, keeping the current session's reads there on the primary for a while."""
+        configured, max_lag = cls._replica_settings_of(site)
+        if configured:
+            (cls._writes.get() or cls._process_writes).wrote(site, max_lag)
+
+    @classmethod
+    def read_routes(cls):
+        """{(("site", site)?, ("route", route)): read-only checkouts}, for the metrics collector."""
+        with cls._route_lock:
+            return {(() if site is None else (("site", site),)) + (("route", route),): count
+                    for (site, route), count in cls._read_routes.items()}
+
+    def replica_lag(self):
+        """Seconds the replica is behind the primary, or None if the backend cannot tell."""
+        if self.backend == "sqlite":
+            # a SQLite replica is a copy kept up to date by an outside tool, which reports no lag here
+            return None
+        pool = ConnectionManager.pool(self.site)
+        conn = pool.acquire()
+        try:
+            # Azure SQL geo-replication, as seen from the primary; NULL until the link is seeded
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(replication_lag_sec) FROM sys.dm_geo_replication_link_status")
+            return cursor.fetchone()[0]
+        finally:
+            pool.release(conn)
+
+    def _replica_route(self):
+        # "replica" while the replica is within ReplicaMaxLag, else "lagging" or "unavailable";
+        # the answer is kept for ReplicaCheckInterval seconds
+        with ConnectionManager._route_lock:
+            route, expires = ConnectionManager._replica_routes.get(self.site, (None, 0.0))
+        if route is not None and time.monotonic() < expires:
+            return route
+        try:
+            lag = self.replica_lag()
+        except (self.driver().Error, PoolTimeout):
+            route = "unavailable"
+        else:
+            route = "replica" if lag is None or lag <= self.replica_max_lag() else "lagging"
+        self._set_replica_route(route)
+        return route
+
+    def _set_replica_route(self, route):
+        with ConnectionManager._route_lock:
+            expires = time.monotonic() + float(self._setting("ReplicaCheckInterval", "10"))
+            ConnectionManager._replica_routes[self.site] = (route, expires)
+
+    def _acquire_read(self):
+        # a replica connection for a read-only manager, or None when the read has to go to the primary
+        writes = ConnectionManager._writes.get()
+        pinned = ConnectionManager._process_writes.pinned(self.site) or (writes is not None and writes.pinned(self.site))
+        route = "pinned" if pinned else self._replica_route()
+        conn = None
+        if route == "replica":
+            try:
+                self._pool = ConnectionManager.pool(self.site, replica=True)
+                conn = self._pool.acquire()
+            except (self.driver().Error, PoolTimeout):
+                # reads fall back to the primary until the next check
+                self._set_replica_route("unavailable")
+                route = "unavailable"
+        with ConnectionManager._route_lock:
+            key = (self.site, route)
+            ConnectionManager._read_routes[key] = ConnectionManager._read_routes.get(key, 0) + 1
+        return conn
+
+    def create_connection(self):
+        # raises the driver's error or PoolTimeout when no connection can be had; Storage decides whether to retry
+        if self.read_only and self.replica_configured():
+            self.conn = self._acquire_read()
+        if self.conn is None:
+            self._pool = ConnectionManager.pool(self.site, self.replica)
+            self.conn = self._pool.acquire()
+        return self.conn
+
+    def close_connection(self):
+        # safe to call more than once; only the first call returns the connection
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self.create_connection()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close_connection()
+        return False
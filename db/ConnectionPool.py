@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of reusable DB-API connections.
+
+    At most max_size connections are open at once; callers block for up to
+    checkout_timeout seconds when all of them are checked out. Idle connections
+    older than max_idle seconds are closed (never dropping below min_size), and
+    a connection that sat idle longer than check_after seconds is pinged before
+    it is handed out again.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, max_idle=300.0,
+                 check_after=30.0, checkout_timeout=30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.checkout_timeout = checkout_timeout
+
+        # (connection, time it was returned), most recently used on the right
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def warm(self):
+        # open min_size connections up front so the first commands skip the handshake
+        conns = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.min_size:
+                        break
+                    self._size += 1
+                try:
+                    conns.append(self.connect())
+                except Exception:
+                    self._forget()
+                    raise
+        finally:
+            for conn in conns:
+                self.release(conn)
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                self._evict_idle()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No connection available after {self.checkout_timeout}s")
+                    self._cond.wait(remaining)
+                    self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn, last_used = None, None
+
+            if conn is None:
+                try:
+                    return self.connect()
+                except Exception:
+                    self._forget()
+                    raise
+
+            if time.monotonic() - last_used < self.check_after or self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # never hand an open transaction (or its locks) to the next caller
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def size(self):
+        with self._cond:
+            return self._size
+
+    def idle_count(self):
+        with self._cond:
+            return len(self._idle)
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _evict_idle(self):
+        # caller holds self._cond; the oldest idle connections are on the left
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._close_quietly(conn)
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,145 @@
+import pymssql
+from db.Storage import RollbackTransaction, Storage
+
+
+class MssqlStorage(Storage):
+    """Azure SQL / SQL Server backend through pymssql."""
+
+    Error = pymssql.Error
+    DIALECT = "mssql"
+
+    USERNAME_LIST_SQL = "STRING_AGG(Username, CHAR(31)) WITHIN GROUP (ORDER BY Username)"
+    TOP_SQL = "TOP ({rows})"
+    # READPAST skips slots other reservers have locked, so concurrent
+    # reservers each claim a different caregiver instead of queueing
+    PICK_CAREGIVER_SQL = """
+        WITH slot AS (
+            SELECT TOP (1) Username, Time
+            FROM Availabilities WITH (UPDLOCK, ROWLOCK, READPAST)
+            WHERE Time = %s
+            ORDER BY {order_by}
+        )
+        DELETE FROM slot OUTPUT DELETED.Username
+    """
+
+    # 2627: PRIMARY KEY or UNIQUE constraint violation, 2601: duplicate key in a unique index
+    DUPLICATE_KEY_ERRORS = (2627, 2601)
+    # errors a retry may get past, by kind: SQL Server error numbers and DB-Library (20xxx) client errors
+    TRANSIENT_ERRORS = {
+        # chosen as deadlock victim
+        1205: "deadlock",
+        # lock request timeout, connection timed out
+        1222: "timeout", 20003: "timeout",
+        # service busy, resource limits reached, too many requests
+        40501: "throttling", 10928: "throttling", 10929: "throttling",
+        49918: "throttling", 49919: "throttling", 49920: "throttling",
+        # database unavailable or failing over, connection lost or refused
+        4060: "connection", 4221: "connection", 40143: "connection", 40197: "connection", 40540: "connection",
+        40613: "connection", 42108: "connection", 42109: "connection", 233: "connection", 10053: "connection",
+        10054: "connection", 10060: "connection", 20006: "connection", 20009: "connection", 20017: "connection",
+        20047: "connection",
+    }
+
+    def _cursor(self, conn):
+        return conn.cursor(as_dict=True)
+
+    # pymssql keeps a transaction open at all times, so savepoints need no BEGIN;
+    # SQL Server has no RELEASE, a savepoint simply ends with the transaction
+    def _savepoint(self, cursor, name):
+        self._execute(cursor, f"SAVE TRANSACTION {name}")
+
+    def _release_savepoint(self, cursor, name):
+        pass
+
+    def _rollback_savepoint(self, cursor, name):
+        self._execute(cursor, f"ROLLBACK TRANSACTION {name}")
+
+    def _explain(self, cursor, statement, params):
+        # with SHOWPLAN_TEXT on, statements return their estimated plan instead of running:
+        # first the statement text, then one row per plan operator
+        self._execute(cursor, "SET SHOWPLAN_TEXT ON")
+        try:
+            self._execute(cursor, statement, params)
+            plan = []
+            while cursor.nextset():
+                plan.extend(row['StmtText'] for row in cursor.fetchall())
+        finally:
+            self._execute(cursor, "SET SHOWPLAN_TEXT OFF")
+        return plan
+
+    def _inserted_id(self, cursor):
+        self._execute(cursor, "SELECT CAST(SCOPE_IDENTITY() AS INT) AS Id")
+        return cursor.fetchone()['Id']
+
+    def _is_duplicate_key(self, error):
+        return isinstance(error, pymssql.IntegrityError) and bool(error.args) \
+            and error.args[0] in self.DUPLICATE_KEY_ERRORS
+
+    def _transient_kind(self, error):
+        if not error.args or not isinstance(error.args[0], int):
+            return None
+        return self.TRANSIENT_ERRORS.get(error.args[0])
+
+    def _upsert_doses_sql(self, rows):
+        # HOLDLOCK keeps two concurrent imports of a new vaccine from both inserting it
+        return f"""
+            MERGE Vaccines WITH (HOLDLOCK) AS target
+            USING (VALUES {", ".join(["(%s, %d)"] * rows)}) AS source (Name, Doses)
+            ON target.Name = source.Name
+            WHEN MATCHED THEN UPDATE SET Doses = target.Doses + source.Doses
+            WHEN NOT MATCHED THEN INSERT (Name, Doses) VALUES (source.Name, source.Doses);
+        """
+
+    def _count_booking_sql(self):
+        # HOLDLOCK: two reservations of one caregiver in the same week must not both insert the row
+        return """
+            MERGE CaregiverLoad WITH (HOLDLOCK) AS target
+            USING (VALUES (%s, %s)) AS source (Username, Week)
+            ON target.Username = source.Username AND target.Week = source.Week
+            WHEN MATCHED THEN UPDATE SET Booked = target.Booked + 1
+            WHEN NOT MATCHED THEN INSERT (Username, Week, Booked) VALUES (source.Username, source.Week, 1);
+        """
+
+    def _reserve(self, d, vaccine, patient):
+        order_by, order_params = self.assignment.order_by(self, d)
+        add_appointment = """
+            INSERT INTO Appointments (Date, Caregiver, Patient, Vaccine)
+            OUTPUT INSERTED.Appointment_id
+            VALUES (%s, %s, %s, %s)
+        """
+        slot_in_flight = "SELECT TOP (1) Username FROM Availabilities WITH (READUNCOMMITTED) WHERE Time = %s"
+        with self._transaction() as cursor:
+            self._execute(cursor, self.PICK_CAREGIVER_SQL.format(order_by=order_by), (d,) + order_params)
+            row = cursor.fetchone()
+            if row is None:
+                # every slot for the date is either gone or being claimed right now
+                self._execute(cursor, slot_in_flight, (d,))
+                outcome = self.SLOT_LOST if cursor.fetchone() else self.NO_CAREGIVER
+                raise RollbackTransaction((outcome, None, None))
+            caregiver = row['Username']
+
+            self._execute(cursor, self.TAKE_DOSE_SQL, (vaccine,))
+            if cursor.rowcount != 1:
+                raise RollbackTransaction((self.NO_DOSES, None, None))
+
+            self._execute(cursor, add_appointment, (d, caregiver, patient, vaccine))
+            appointment_id = cursor.fetchone()['Appointment_id']
+            self._execute(cursor, self._count_booking_sql(), (caregiver, self.week_of(d)))
+        return self.RESERVED, caregiver, appointment_id
+
+    def _book_slot(self, cursor, d, caregiver, patient, vaccine, slot):
+        # UPDLOCK, HOLDLOCK range-locks the slot's key in UX_Appointments_Slot until commit, so a
+        # concurrent reserver of the same slot waits and then finds it taken instead of violating the index
+        book_slot = """
+            INSERT INTO Appointments (Date, Caregiver, Patient, Vaccine, Slot)
+            OUTPUT INSERTED.Appointment_id
+            SELECT %s, %s, %s, %s, %d
+            WHERE EXISTS (SELECT 1 FROM Shifts WHERE Date = %s AND Username = %s
+                          AND StartMinute <= %d AND EndMinute > %d)
+            AND NOT EXISTS (SELECT 1 FROM Appointments WITH (UPDLOCK, HOLDLOCK)
+                            WHERE Caregiver = %s AND Date = %s AND Slot = %d)
+        """
+        self._execute(cursor, book_slot, (d, caregiver, patient, vaccine, slot, d, caregiver, slot, slot,
+                                          caregiver, d, slot))
+        row = cursor.fetchone()
+        return row['Appointment_id'] if row else None
@@ -0,0 +1,379 @@
+import datetime
+
+
+def _mssql_index(name, table, definition, unique=False):
+    # SQL Server has no CREATE INDEX IF NOT EXISTS
+    return f"""
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}'))
+            CREATE {"UNIQUE " if unique else ""}INDEX {name} ON {table} {definition}
+    """
+
+
+def _sqlite_add_work_factor(storage, cursor):
+    # SQLite has no ADD COLUMN IF NOT EXISTS; databases created by older versions may already have it
+    for table in storage.ACCOUNT_TABLES:
+        storage._execute(cursor, f"PRAGMA table_info({table})")
+        if "WorkFactor" not in {row['name'] for row in cursor.fetchall()}:
+            storage._execute(cursor, f"ALTER TABLE {table} ADD COLUMN WorkFactor INT")
+
+
+class Schema:
+    """
+    Versioned schema for both backends. Each migration is applied once, in its
+    own transaction, and recorded in the SchemaVersion table; migrate() brings
+    a database of any earlier version (or an empty one) up to date. Steps are
+    SQL strings or callables taking (storage, cursor), listed per dialect.
+
+    check() returns the plan of every hot statement so a query that regresses to
+    a table scan shows up before it shows up in latency.
+    """
+
+    VERSION_TABLE = {
+        "mssql": """
+            IF OBJECT_ID('SchemaVersion') IS NULL
+            CREATE TABLE SchemaVersion (
+                Version INT PRIMARY KEY,
+                Description VARCHAR(255),
+                AppliedAt DATETIME2 DEFAULT SYSUTCDATETIME()
+            )
+        """,
+        "sqlite": """
+            CREATE TABLE IF NOT EXISTS SchemaVersion (
+                Version INT PRIMARY KEY,
+                Description VARCHAR(255),
+                AppliedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+    }
+
+    # held until the migration commits, so concurrent starts apply each migration once
+    # (SQLite's BEGIN IMMEDIATE already serializes them)
+    MIGRATION_LOCK = {
+        "mssql": "EXEC sp_getapplock @Resource = 'SchemaVersion', @LockMode = 'Exclusive', @LockOwner = 'Transaction'",
+    }
+
+    MIGRATIONS = (
+        (1, "accounts, vaccines, availabilities and appointments", {
+            "mssql": (
+                """
+                IF OBJECT_ID('Caregivers') IS NULL
+                CREATE TABLE Caregivers (
+                    Username VARCHAR(255) PRIMARY KEY,
+                    Salt BINARY(16),
+                    Hash BINARY(16)
+                )
+                """,
+                """
+                IF OBJECT_ID('Patients') IS NULL
+                CREATE TABLE Patients (
+                    Username VARCHAR(255) PRIMARY KEY,
+                    Salt BINARY(16),
+                    Hash BINARY(16)
+                )
+                """,
+                """
+                IF OBJECT_ID('Vaccines') IS NULL
+                CREATE TABLE Vaccines (
+                    Name VARCHAR(255) PRIMARY KEY,
+                    Doses INT
+                )
+                """,
+                """
+                IF OBJECT_ID('Availabilities') IS NULL
+                CREATE TABLE Availabilities (
+                    Time DATE,
+                    Username VARCHAR(255) REFERENCES Caregivers,
+                    PRIMARY KEY (Time, Username)
+                )
+                """,
+                """
+                IF OBJECT_ID('Appointments') IS NULL
+                CREATE TABLE Appointments (
+                    Appointment_id INT IDENTITY(1, 1) PRIMARY KEY,
+                    Date DATE,
+                    Caregiver VARCHAR(255) REFERENCES Caregivers,
+                    Patient VARCHAR(255) REFERENCES Patients,
+                    Vaccine VARCHAR(255) REFERENCES Vaccines
+                )
+                """,
+            ),
+            "sqlite": (
+                """
+                CREATE TABLE IF NOT EXISTS Caregivers (
+                    Username VARCHAR(255) PRIMARY KEY,
+                    Salt BLOB,
+                    Hash BLOB
+                )
+                """,
+                """
+                CREATE TABLE IF NOT EXISTS Patients (
+                    Username VARCHAR(255) PRIMARY KEY,
+                    Salt BLOB,
+                    Hash BLOB
+                )
+                """,
+                """
+                CREATE TABLE IF NOT EXISTS Vaccines (
+                    Name VARCHAR(255) PRIMARY KEY,
+                    Doses INT
+                )
+                """,
+                """
+                CREATE TABLE IF NOT EXISTS Availabilities (
+                    Time DATE,
+                    Username VARCHAR(255) REFERENCES Caregivers,
+                    PRIMARY KEY (Time, Username)
+                )
+                """,
+                """
+                CREATE TABLE IF NOT EXISTS Appointments (
+                    Appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    Date DATE,
+                    Caregiver VARCHAR(255) REFERENCES Caregivers,
+                    Patient VARCHAR(255) REFERENCES Patients,
+                    Vaccine VARCHAR(255) REFERENCES Vaccines
+                )
+                """,
+            ),
+        }),
+        (2, "password work factor per account", {
+            "mssql": tuple(f"IF COL_LENGTH('{table}', 'WorkFactor') IS NULL ALTER TABLE {table} ADD WorkFactor INT"
+                           for table in ("Patients", "Caregivers")),
+            "sqlite": (_sqlite_add_work_factor,),
+        }),
+        (3, "covering indexes for the availability upload and appointment history lookups", {
+            # the (Time, Username) primary key already serves the per-date lookups and the slot claim
+            "mssql": (
+                _mssql_index("IX_Availabilities_Username_Time", "Availabilities", "(Username, Time)"),
+                _mssql_index("IX_Appointments_Patient", "Appointments",
+                             "(Patient, Appointment_id) INCLUDE (Date, Vaccine, Caregiver)"),
+                _mssql_index("IX_Appointments_Caregiver", "Appointments",
+                             "(Caregiver, Appointment_id) INCLUDE (Date, Vaccine, Patient)"),
+            ),
+            "sqlite": (
+                "CREATE INDEX IF NOT EXISTS IX_Availabilities_Username_Time ON Availabilities (Username, Time)",
+                """
+                CREATE INDEX IF NOT EXISTS IX_Appointments_Patient
+                ON Appointments (Patient, Appointment_id, Date, Vaccine, Caregiver)
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS IX_Appointments_Caregiver
+                ON Appointments (Caregiver, Appointment_id, Date, Vaccine, Patient)
+                """,
+            ),
+        }),
+        (4, "per-caregiver weekly booking counters for load-balanced assignment", {
+            # Week is the Monday of the appointment's week; existing appointments are counted in
+            "mssql": (
+                """
+                IF OBJECT_ID('CaregiverLoad') IS NULL
+                CREATE TABLE CaregiverLoad (
+                    Username VARCHAR(255) REFERENCES Caregivers,
+                    Week DATE,
+                    Booked INT NOT NULL,
+                    PRIMARY KEY (Username, Week)
+                )
+                """,
+                """
+                INSERT INTO CaregiverLoad (Username, Week, Booked)
+                SELECT Caregiver, DATEADD(day, -((DATEPART(weekday, Date) + @@DATEFIRST + 5) % 7), Date), COUNT(*)
+                FROM Appointments
+                GROUP BY Caregiver, DATEADD(day, -((DATEPART(weekday, Date) + @@DATEFIRST + 5) % 7), Date)
+                """,
+            ),
+            "sqlite": (
+                """
+                CREATE TABLE IF NOT EXISTS CaregiverLoad (
+                    Username VARCHAR(255) REFERENCES Caregivers,
+                    Week DATE,
+                    Booked INT NOT NULL,
+                    PRIMARY KEY (Username, Week)
+                )
+                """,
+                """
+                INSERT INTO CaregiverLoad (Username, Week, Booked)
+                SELECT Caregiver, date(Date, 'weekday 0', '-6 days'), COUNT(*)
+                FROM Appointments
+                GROUP BY Caregiver, date(Date, 'weekday 0', '-6 days')
+                """,
+            ),
+        }),
+        (5, "waitlist of patients waiting for an opening", {
+            # no foreign key on Vaccine: patients may wait for a vaccine that has never been stocked
+            "mssql": (
+                """
+                IF OBJECT_ID('Waitlist') IS NULL
+                CREATE TABLE Waitlist (
+                    Request_id INT IDENTITY(1, 1) PRIMARY KEY,
+                    Patient VARCHAR(255) REFERENCES Patients,
+                    Vaccine VARCHAR(255),
+                    FirstDate DATE,
+                    LastDate DATE,
+                    RequestedAt DATETIME2 DEFAULT SYSUTCDATETIME()
+                )
+                """,
+                _mssql_index("IX_Waitlist_Patient", "Waitlist", "(Patient, Request_id)"),
+            ),
+            "sqlite": (
+                """
+                CREATE TABLE IF NOT EXISTS Waitlist (
+                    Request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    Patient VARCHAR(255) REFERENCES Patients,
+                    Vaccine VARCHAR(255),
+                    FirstDate DATE,
+                    LastDate DATE,
+                    RequestedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """,
+                "CREATE INDEX IF NOT EXISTS IX_Waitlist_Patient ON Waitlist (Patient, Request_id)",
+            ),
+        }),
+        (6, "caregiver shifts split into time slots, and the slot an appointment books", {
+            # Slot is the booked slot's start in minutes after midnight, NULL for whole-day bookings;
+            # the filtered unique index is what stops two reservers booking one slot
+            "mssql": (
+                """
+                IF OBJECT_ID('Shifts') IS NULL
+                CREATE TABLE Shifts (
+                    Date DATE,
+                    Username VARCHAR(255) REFERENCES Caregivers,
+                    StartMinute INT,
+                    EndMinute INT,
+                    SlotMinutes INT,
+                    PRIMARY KEY (Date, Username, StartMinute)
+                )
+                """,
+                _mssql_index("IX_Shifts_Username", "Shifts", "(Username, Date)"),
+                "IF COL_LENGTH('Appointments', 'Slot') IS NULL ALTER TABLE Appointments ADD Slot INT",
+                _mssql_index("UX_Appointments_Slot", "Appointments", "(Caregiver, Date, Slot) WHERE Slot IS NOT NULL",
+                             unique=True),
+                "DROP INDEX IF EXISTS IX_Appointments_Patient ON Appointments",
+                "DROP INDEX IF EXISTS IX_Appointments_Caregiver ON Appointments",
+                _mssql_index("IX_Appointments_Patient", "Appointments",
+                             "(Patient, Appointment_id) INCLUDE (Date, Vaccine, Caregiver, Slot)"),
+                _mssql_index("IX_Appointments_Caregiver", "Appointments",
+                             "(Caregiver, Appointment_id) INCLUDE (Date, Vaccine, Patient, Slot)"),
+            ),
+            "sqlite": (
+                """
+                CREATE TABLE IF NOT EXISTS Shifts (
+                    Date DATE,
+                    Username VARCHAR(255) REFERENCES Caregivers,
+                    StartMinute INT,
+                    EndMinute INT,
+                    SlotMinutes INT,
+                    PRIMARY KEY (Date, Username, StartMinute)
+                )
+                """,
+                "CREATE INDEX IF NOT EXISTS IX_Shifts_Username ON Shifts (Username, Date)",
+                "ALTER TABLE Appointments ADD COLUMN Slot INT",
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS UX_Appointments_Slot
+                ON Appointments (Caregiver, Date, Slot) WHERE Slot IS NOT NULL
+                """,
+                "DROP INDEX IF EXISTS IX_Appointments_Patient",
+                "DROP INDEX IF EXISTS IX_Appointments_Caregiver",
+                """
+                CREATE INDEX IF NOT EXISTS IX_Appointments_Patient
+                ON Appointments (Patient, Appointment_id, Date, Vaccine, Caregiver, Slot)
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS IX_Appointments_Caregiver
+                ON Appointments (Caregiver, Appointment_id, Date, Vaccine, Patient, Slot)
+                """,
+            ),
+        }),
+        (7, "days between the doses of a vaccine series", {
+            # NULL for single-dose vaccines
+            "mssql": ("IF COL_LENGTH('Vaccines', 'IntervalDays') IS NULL ALTER TABLE Vaccines ADD IntervalDays INT",),
+            "sqlite": ("ALTER TABLE Vaccines ADD COLUMN IntervalDays INT",),
+        }),
+        (8, "appointments by date for the dose usage forecast", {
+            "mssql": (_mssql_index("IX_Appointments_Date", "Appointments", "(Date, Vaccine)"),),
+            "sqlite": ("CREATE INDEX IF NOT EXISTS IX_Appointments_Date ON Appointments (Date, Vaccine)",),
+        }),
+    )
+
+    # plan lines that mean a whole table or index is read
+    SCAN_MARKERS = {
+        "mssql": ("Table Scan", "Index Scan"),
+        "sqlite": ("SCAN ",),
+    }
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.dialect = storage.DIALECT
+
+    @property
+    def latest(self):
+        return self.MIGRATIONS[-1][0]
+
+    def version(self):
+        with self.storage._transaction(pin_reads=False) as cursor:
+            return self._version(cursor)
+
+    def _version(self, cursor):
+        self.storage._execute(cursor, self.VERSION_TABLE[self.dialect])
+        self.storage._execute(cursor, "SELECT MAX(Version) AS Version FROM SchemaVersion")
+        row = cursor.fetchone()
+        return (row['Version'] or 0) if row else 0
+
+    def migrate(self):
+        """Apply every migration newer than the database; returns the versions applied."""
+        applied = []
+        for version, description, steps in self.MIGRATIONS:
+            # most runs find the database up to date, which must not send every session's reads to the primary
+            with self.storage._transaction(pin_reads=False) as cursor:
+                if self.dialect in self.MIGRATION_LOCK:
+                    self.storage._execute(cursor, self.MIGRATION_LOCK[self.dialect])
+                if self._version(cursor) >= version:
+                    continue
+                for step in steps[self.dialect]:
+                    if callable(step):
+                        step(self.storage, cursor)
+                    else:
+                        self.storage._execute(cursor, step)
+                self.storage._execute(cursor, "INSERT INTO SchemaVersion (Version, Description) VALUES (%d, %s)",
+                                      (version, description))
+            applied.append(version)
+        if applied:
+            # a replica has not seen the new schema yet
+            self.storage._pin_reads()
+        return applied
+
+    def hot_statements(self):
+        # (name, statement, sample parameters) for the statements every command path runs, as Storage runs them
+        storage = self.storage
+        day = datetime.datetime(2000, 1, 1)
+        order_by, order_params = storage.assignment.order_by(storage, day)
+        return [
+            ("login_patient", storage.CREDENTIALS_SQL.format(table=storage.PATIENTS), ("u",)),
+            ("login_caregiver", storage.CREDENTIALS_SQL.format(table=storage.CAREGIVERS), ("u",)),
+            ("caregivers_on_date", storage.CAREGIVERS_ON_DATE_SQL, (day,)),
+            ("caregivers_by_day", storage.availability_by_day_sql(), (day, day)),
+            # the caregiver pick under the configured assignment strategy, its CaregiverLoad lookup included
+            ("pick_caregiver", storage.PICK_CAREGIVER_SQL.format(order_by=order_by), (day,) + order_params),
+            ("uploaded_dates", storage.UPLOADED_DATES_SQL, ("u", day, day)),
+            ("shift_caregiver_load", storage.weekly_bookings_sql(2), (storage.week_of(day), "u", "v")),
+            ("shifts_on_date", storage.SHIFTS_SQL, (day,)),
+            ("booked_slots", storage.BOOKED_SLOTS_SQL, (day, day)),
+            ("open_series_dates", storage.open_dates_sql(2), (day, day, day, day)),
+            ("dose_usage", storage.DOSE_USAGE_SQL, (day, day)),
+            ("take_dose", storage.TAKE_DOSE_SQL, ("v",)),
+            ("patient_appointments", storage.appointments_sql(storage.PATIENTS, storage.PAGE_SIZE, first=True),
+             ("u", 0, day)),
+            ("caregiver_appointments", storage.appointments_sql(storage.CAREGIVERS, storage.PAGE_SIZE, first=True),
+             ("u", 0, day)),
+        ]
+
+    def check(self):
+        """[(name, plan lines, whether the plan scans)] for every hot statement."""
+        markers = self.SCAN_MARKERS[self.dialect]
+        report = []
+        for name, statement, params in self.hot_statements():
+            plan = self.storage.explain(statement, params)
+            # a subquery's result is read whole by design; only scans of tables and indexes count
+            derived = {line.split()[1] for line in plan if line.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+            scans = any(marker in line and line.split()[1] not in derived for line in plan for marker in markers)
+            report.append((name, plan, scans))
+        return report
@@ -0,0 +1,90 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class SiteRouter:
+    """
+    Maps clinic sites to databases. Sites are listed in the Sites environment
+    variable (e.g. Sites=north,south; the first is the home site new accounts
+    default to) and each is a database of its own, configured through
+    db.ConnectionManager's per-site settings. A site's caregivers, their
+    availability and shifts, its vaccine stock and the appointments booked
+    there all live in its database, so the site of a row is the database
+    holding it and no statement changes; capacity grows by adding a site.
+
+    The current site is a context variable, like Storage.batch(), so
+    get_storage() routes every model and command to it without being told.
+    fan_out() runs a read against every site at once for cross-site searches.
+    Without Sites there is a single unnamed site, None.
+    """
+
+    def __init__(self):
+        self.sites = [site.strip().lower() for site in os.getenv("Sites", "").split(",") if site.strip()] or [None]
+        self.home = self.sites[0]
+        self._site = contextvars.ContextVar("site", default=None)
+        workers = int(os.getenv("SiteWorkers", str(len(self.sites))))
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="site")
+
+    @property
+    def sharded(self):
+        return len(self.sites) > 1
+
+    def current(self):
+        site = self._site.get()
+        return self.home if site is None else site
+
+    def check(self, site):
+        if site not in self.sites:
+            raise ValueError(f"Unknown site: {site} (choose from {', '.join(map(str, self.sites))})")
+        return site
+
+    @contextmanager
+    def use(self, site):
+        """Route get_storage() to site inside the block; None means the home site."""
+        token = self._site.set(site)
+        try:
+            yield
+        finally:
+            self._site.reset(token)
+
+    def fan_out(self, work, sites=None):
+        """
+        Run work(site) for every site (default: all) in parallel, each inside
+        use(site), and return {site: result} in site order. If any site fails,
+        the first failure is raised once every site has finished.
+        """
+        sites = list(self.sites if sites is None else sites)
+        if len(sites) == 1:
+            return {sites[0]: self._run(sites[0], work)}
+        # each task gets a copy of the caller's context, so metrics count its statements against the command
+        futures = [(site, self._executor.submit(contextvars.copy_context().run, self._run, site, work))
+                   for site in sites]
+        results, error = {}, None
+        for site, future in futures:
+            try:
+                results[site] = future.result()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    def _run(self, site, work):
+        with self.use(site):
+            return work(site)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = SiteRouter()
+    return _router
@@ -0,0 +1,106 @@
+import datetime
+import re
+import sqlite3
+from db.Storage import RollbackTransaction, Storage
+
+
+class SqliteStorage(Storage):
+    """
+    Embedded SQLite backend (a file or :memory:) with the same schema as the
+    Azure database, for running the scheduler and its benchmarks on one box.
+    """
+
+    Error = sqlite3.Error
+    DIALECT = "sqlite"
+
+    USERNAME_LIST_SQL = "group_concat(Username, char(31))"
+    LIMIT_SQL = "LIMIT {rows}"
+    PICK_CAREGIVER_SQL = "SELECT Username FROM Availabilities WHERE Time = %s ORDER BY {order_by} LIMIT 1"
+
+    _placeholder = re.compile(r"%[sd]")
+
+    def __init__(self, site=None):
+        super().__init__(site)
+        self._statements = {}
+
+    def _sql(self, statement):
+        translated = self._statements.get(statement)
+        if translated is None:
+            translated = self._statements[statement] = self._placeholder.sub("?", statement)
+        return translated
+
+    def _params(self, params):
+        # dates are stored as ISO text, which sorts and compares like the date itself
+        return tuple(p.date().isoformat() if isinstance(p, datetime.datetime)
+                     else p.isoformat() if isinstance(p, datetime.date) else p
+                     for p in params)
+
+    def _begin(self, cursor):
+        # take the write lock up front so concurrent writers queue on the busy
+        # timeout instead of failing when they try to upgrade a read lock
+        self._execute(cursor, "BEGIN IMMEDIATE")
+
+    def _explain(self, cursor, statement, params):
+        self._execute(cursor, "EXPLAIN QUERY PLAN " + statement, params)
+        return [row['detail'] for row in cursor.fetchall()]
+
+    def _inserted_id(self, cursor):
+        return cursor.lastrowid
+
+    def _is_duplicate_key(self, error):
+        # sqlite3 reports every constraint as IntegrityError; only the message tells them apart
+        return isinstance(error, sqlite3.IntegrityError) and str(error).startswith("UNIQUE constraint failed")
+
+    def _transient_kind(self, error):
+        # "database is locked" stays permanent, like a PoolTimeout: it only comes once the 30 s busy timeout
+        # has already waited for the write lock, so each retry would just repeat the wait
+        return None
+
+    def _upsert_doses_sql(self, rows):
+        return f"""
+            INSERT INTO Vaccines (Name, Doses) VALUES {", ".join(["(%s, %d)"] * rows)}
+            ON CONFLICT (Name) DO UPDATE SET Doses = Doses + excluded.Doses
+        """
+
+    def _count_booking_sql(self):
+        return """
+            INSERT INTO CaregiverLoad (Username, Week, Booked) VALUES (%s, %s, 1)
+            ON CONFLICT (Username, Week) DO UPDATE SET Booked = Booked + 1
+        """
+
+    def _reserve(self, d, vaccine, patient):
+        order_by, order_params = self.assignment.order_by(self, d)
+        claim_caregiver = "DELETE FROM Availabilities WHERE Time = %s AND Username = %s"
+        add_appointment = "INSERT INTO Appointments (Date, Caregiver, Patient, Vaccine) VALUES (%s, %s, %s, %s)"
+        with self._transaction() as cursor:
+            self._execute(cursor, self.PICK_CAREGIVER_SQL.format(order_by=order_by), (d,) + order_params)
+            row = cursor.fetchone()
+            if row is None:
+                raise RollbackTransaction((self.NO_CAREGIVER, None, None))
+            caregiver = row['Username']
+
+            self._execute(cursor, claim_caregiver, (d, caregiver))
+            if cursor.rowcount != 1:
+                raise RollbackTransaction((self.SLOT_LOST, None, None))
+
+            self._execute(cursor, self.TAKE_DOSE_SQL, (vaccine,))
+            if cursor.rowcount != 1:
+                raise RollbackTransaction((self.NO_DOSES, None, None))
+
+            self._execute(cursor, add_appointment, (d, caregiver, patient, vaccine))
+            appointment_id = cursor.lastrowid
+            self._execute(cursor, self._count_booking_sql(), (caregiver, self.week_of(d)))
+        return self.RESERVED, caregiver, appointment_id
+
+    def _book_slot(self, cursor, d, caregiver, patient, vaccine, slot):
+        # BEGIN IMMEDIATE already serializes writers, so the checks cannot race the insert
+        book_slot = """
+            INSERT INTO Appointments (Date, Caregiver, Patient, Vaccine, Slot)
+            SELECT %s, %s, %s, %s, %d
+            WHERE EXISTS (SELECT 1 FROM Shifts WHERE Date = %s AND Username = %s
+                          AND StartMinute <= %d AND EndMinute > %d)
+            AND NOT EXISTS (SELECT 1 FROM Appointments WHERE Caregiver = %s AND Date = %s AND Slot = %d)
+        """
+        self._execute(cursor, book_slot, (d, caregiver, patient, vaccine, slot, d, caregiver, slot, slot,
+                                          caregiver, d, slot))
+        return cursor.lastrowid if cursor.rowcount == 1 else None
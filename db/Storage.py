@@ -0,0 +1,1172 @@
+import contextvars
+import datetime
+import functools
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from db.Assignment import get_strategy
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import PoolTimeout
+from db.Schema import Schema
+from db.SiteRouter import get_router
+from util.BitCalendar import BitCalendar
+from util.BloomFilter import BloomFilter
+from util.CircuitBreaker import CircuitBreaker
+from util.Metrics import metrics
+from util.ShiftIndex import ShiftIndex
+from util.TTLCache import TTLCache
+
+
+class StorageError(Exception):
+    """Backend-neutral database error; the driver's exception is kept as __cause__."""
+
+
+class UsernameTaken(StorageError):
+    """add_account() hit the username's uniqueness constraint."""
+
+
+class TransientError(StorageError):
+    """
+    A failure that running the same work again may get past; kind is
+    "deadlock", "timeout", "throttling" or "connection".
+    """
+
+    def __init__(self, error, kind):
+        super().__init__(error)
+        self.kind = kind
+
+
+class CircuitOpen(StorageError):
+    """The database kept failing transiently, so calls fail fast until the circuit breaker lets one through."""
+
+
+class RollbackTransaction(Exception):
+    """Raised inside _transaction() to undo it; result is what the caller reports instead."""
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+def retried(method):
+    # run a Storage method through Storage._resilient(), which retries it after transient failures
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self._resilient(method, self, *args, **kwargs)
+    return wrapper
+
+
+class Storage:
+    """
+    Every query the models and Scheduler commands run, behind one interface.
+
+    Statements are written once here in the %s paramstyle; backends override
+    the hooks below (cursor type, parameter style, transaction start) and the
+    few statements that need dialect-specific SQL.
+    """
+
+    # account tables; table names cannot be bound as parameters
+    PATIENTS = "Patients"
+    CAREGIVERS = "Caregivers"
+    ACCOUNT_TABLES = (PATIENTS, CAREGIVERS)
+
+    # outcomes of reserve()
+    RESERVED = "reserved"
+    NO_CAREGIVER = "no_caregiver"
+    SLOT_LOST = "slot_lost"
+    NO_DOSES = "no_doses"
+
+    # driver exception base class and db.Schema dialect name, set by each backend
+    Error = Exception
+    DIALECT = None
+
+    # aggregate of the usernames in a GROUP BY, joined by USERNAME_SEPARATOR (CHAR(31), ASCII unit separator)
+    USERNAME_LIST_SQL = None
+    USERNAME_SEPARATOR = "\x1f"
+
+    # row limiting clauses, formatted with rows=<n>; one of them is empty per backend
+    TOP_SQL = ""
+    LIMIT_SQL = ""
+    # the caregiver reserve() books on a date, formatted with the assignment strategy's order_by; set by each
+    # backend and run with (date,) + the strategy's parameters
+    PICK_CAREGIVER_SQL = None
+    # rows fetched per keyset page of iter_appointments()
+    PAGE_SIZE = 500
+
+    # rows per upsert statement; SQL Server caps a VALUES list at 1000 rows and 2100 parameters
+    UPSERT_BATCH = 500
+
+    # keys of the vaccine_cache entries
+    VACCINES = "vaccines"
+    VACCINE_INTERVALS = "intervals"
+
+    # a date's shifts, and the slots booked in them; shift_index() builds its ShiftIndex from these
+    SHIFTS_SQL = "SELECT Username, StartMinute, EndMinute, SlotMinutes FROM Shifts WHERE Date = %s"
+    BOOKED_SLOTS_SQL = """
+        SELECT Caregiver, Slot FROM Appointments
+        WHERE Caregiver IN (SELECT Username FROM Shifts WHERE Date = %s) AND Date = %s AND Slot IS NOT NULL
+    """
+    # statements of the command paths that db.Schema's plan check also runs, kept here so both use the same text
+    CREDENTIALS_SQL = "SELECT Salt, Hash, WorkFactor FROM {table} WHERE Username = %s"
+    CAREGIVERS_ON_DATE_SQL = "SELECT Username FROM Availabilities WHERE Time = %s ORDER BY Username"
+    UPLOADED_DATES_SQL = "SELECT Time FROM Availabilities WHERE Username = %s AND Time BETWEEN %s AND %s"
+    TAKE_DOSE_SQL = "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %s AND Doses > 0"
+    # doses booked per vaccine, in all and on its busiest day: the input of the depletion forecast
+    DOSE_USAGE_SQL = """
+        SELECT Vaccine, SUM(Booked) AS Total, MAX(Booked) AS Peak
+        FROM (
+            SELECT Vaccine, COUNT(*) AS Booked
+            FROM Appointments
+            WHERE Date BETWEEN %s AND %s
+            GROUP BY Vaccine, Date
+        ) AS PerDay
+        GROUP BY Vaccine
+    """
+    # free slots reserve() tries before reporting SLOT_LOST, when others book the ones it saw first
+    SLOT_ATTEMPTS = 5
+
+    def __init__(self, site=None):
+        # the site (database) this storage serves, None without sites
+        self.site = site
+        # read-through caches for browse traffic, invalidated by the write paths below;
+        # other processes' writes become visible after at most CacheTTL seconds. They load from the primary:
+        # every session reads them, so a stale replica read would hide a write even from the session that made it
+        ttl = float(os.getenv("CacheTTL", "5"))
+        self.vaccine_cache = TTLCache(maxsize=2, ttl=ttl)
+        self.availability_cache = TTLCache(maxsize=int(os.getenv("CacheMaxDates", "1024")), ttl=ttl)
+        self.shift_cache = TTLCache(maxsize=int(os.getenv("CacheMaxDates", "1024")), ttl=ttl)
+        # every caregiver's availability as day bitsets, which answers the availability lookups in memory
+        # when enabled; this process's writes update it, other processes' show up on the next reload
+        self.calendar_enabled = os.getenv("AvailabilityCalendar", "1") != "0"
+        self.calendar_refresh = float(os.getenv("CalendarRefresh", "60"))
+        self._calendar = None
+        self._calendar_expires = 0.0
+        self._calendar_loading = False
+        # writes committed while a reload runs, replayed onto the reloaded calendar
+        self._calendar_pending = []
+        self._calendar_hits = 0
+        self._calendar_loads = 0
+        self._calendar_lock = threading.Lock()
+        # per account table, a Bloom filter of the usernames taken, so username_taken() answers names it has
+        # never seen without a query; rebuilt after UsernameFilterRefresh seconds to pick up other processes'
+        self.username_filter_enabled = os.getenv("UsernameFilter", "0") != "0"
+        self.username_filter_capacity = int(os.getenv("UsernameFilterCapacity", "1000000"))
+        self.username_filter_refresh = float(os.getenv("UsernameFilterRefresh", "300"))
+        self._username_filters = {}
+        self._username_filter_hits = 0
+        self._username_filter_misses = 0
+        self._username_filter_lock = threading.Lock()
+        # which available caregiver reserve() books
+        self.assignment = get_strategy(os.getenv("AssignmentStrategy", "least_booked"), os.getenv("AssignmentSeed"))
+        # connection, savepoint counter and queued calendar changes of the batch() running in this context, if any
+        self._batch = contextvars.ContextVar("storage_batch", default=None)
+        # transient failures are retried RetryAttempts times in all, after jittered exponential backoff;
+        # BreakerThreshold failures in a row open the circuit breaker for BreakerCooldown seconds
+        self.retry_attempts = max(int(os.getenv("RetryAttempts", "4")), 1)
+        self.retry_base_delay = float(os.getenv("RetryBaseDelay", "0.05"))
+        self.retry_max_delay = float(os.getenv("RetryMaxDelay", "2"))
+        self.breaker = CircuitBreaker(int(os.getenv("BreakerThreshold", "5")), float(os.getenv("BreakerCooldown", "10")))
+        # whether a _resilient() call is running in this context, which then retries the calls it makes
+        self._retrying = contextvars.ContextVar("storage_retrying", default=False)
+        # (event, error kind) -> count, for resilience_stats()
+        self._resilience_events = {}
+        self._resilience_lock = threading.Lock()
+
+    def cache_stats(self):
+        stats = {"vaccines": self.vaccine_cache.stats(), "availability": self.availability_cache.stats(),
+                 "shifts": self.shift_cache.stats()}
+        if self.calendar_enabled:
+            with self._calendar_lock:
+                stats["calendar"] = {"hits": self._calendar_hits, "misses": self._calendar_loads,
+                                     "size": len(self._calendar) if self._calendar is not None else 0}
+        if self.username_filter_enabled:
+            # hits: names the filter rejected without a query; misses: names it had to look up
+            with self._username_filter_lock:
+                stats["usernames"] = {"hits": self._username_filter_hits, "misses": self._username_filter_misses,
+                                      "size": sum(len(f) for f, expires in self._username_filters.values())}
+        return stats
+
+    def _availability_calendar(self):
+        """
+        The calendar of every caregiver's free days, (re)loaded from
+        Availabilities once older than CalendarRefresh seconds, or None when
+        the lookup should go to the database: calendar disabled, inside a batch
+        (which must see its own uncommitted writes), or no calendar yet while
+        another thread loads it.
+        """
+        if not self.calendar_enabled or self._batch.get() is not None:
+            return None
+        with self._calendar_lock:
+            calendar = self._calendar
+            if calendar is not None and (self._calendar_loading or time.monotonic() < self._calendar_expires):
+                self._calendar_hits += 1
+                return calendar
+            if self._calendar_loading:
+                return None
+            self._calendar_loading = True
+            self._calendar_pending = []
+            self._calendar_loads += 1
+        try:
+            calendar = BitCalendar()
+            for username, caregiver_days in self._availability_days().items():
+                calendar.add_many(username, caregiver_days)
+        except BaseException:
+            with self._calendar_lock:
+                self._calendar_loading = False
+            raise
+        with self._calendar_lock:
+            self._calendar_loading = False
+            # adds and removes are idempotent, so replaying one the snapshot already saw is harmless
+            for change in self._calendar_pending:
+                change(calendar)
+            self._calendar_pending = []
+            self._calendar = calendar
+            self._calendar_expires = time.monotonic() + self.calendar_refresh
+        return calendar
+
+    @retried
+    def _availability_days(self):
+        # {caregiver: [available dates]} for the calendar, read in pages
+        days = {}
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            self._execute(cursor, "SELECT Username, Time FROM Availabilities")
+            rows = cursor.fetchmany(self.PAGE_SIZE)
+            while rows:
+                for row in rows:
+                    days.setdefault(row['Username'], []).append(self._as_date(row['Time']))
+                rows = cursor.fetchmany(self.PAGE_SIZE)
+        return days
+
+    def _calendar_change(self, change):
+        # apply a committed availability write to the calendar; a write inside batch() is only
+        # committed with the batch, so it is queued there and applied then, or dropped with a rollback
+        batch = self._batch.get()
+        if batch is not None:
+            batch[2].append(change)
+            return
+        with self._calendar_lock:
+            if self._calendar_loading:
+                self._calendar_pending.append(change)
+            if self._calendar is not None:
+                change(self._calendar)
+
+    def resilience_stats(self):
+        """Retries by error kind, calls that gave up, and the circuit breaker's state, openings and rejected calls."""
+        with self._resilience_lock:
+            events = dict(self._resilience_events)
+        stats = {"retries": {kind: count for (event, kind), count in events.items() if event == "retry"},
+                 "gave_up": sum(count for (event, kind), count in events.items() if event == "gave_up")}
+        stats.update(self.breaker.stats())
+        return stats
+
+    def _resilience_metrics(self):
+        site = () if self.site is None else (("site", self.site),)
+        with self._resilience_lock:
+            events = {site + (("event", event), ("kind", kind)): count
+                      for (event, kind), count in self._resilience_events.items()}
+        breaker = self.breaker.stats()
+        events[site + (("event", "circuit_opened"), ("kind", "none"))] = breaker["opened"]
+        events[site + (("event", "rejected"), ("kind", "none"))] = breaker["rejected"]
+        return events
+
+    def _resilience_event(self, event, kind):
+        with self._resilience_lock:
+            self._resilience_events[(event, kind)] = self._resilience_events.get((event, kind), 0) + 1
+
+    def _resilient(self, operation, *args, **kwargs):
+        """
+        Run operation, retrying it after a TransientError with jittered
+        exponential backoff, and refuse it with CircuitOpen while the circuit
+        breaker is open. Only work that is safe to run twice comes here:
+        reads, and transactions, which a failure before the commit leaves
+        undone (a failed commit raises a plain StorageError). Inside a batch()
+        the work cannot be retried alone, and inside another _resilient() call
+        the outer call retries, so both just run it.
+        """
+        if self._batch.get() is not None or self._retrying.get():
+            return operation(*args, **kwargs)
+        if not self.breaker.allow():
+            raise CircuitOpen(f"Database unavailable, try again in {self.breaker.retry_after():.0f}s")
+        token = self._retrying.set(True)
+        try:
+            for attempt in itertools.count(1):
+                try:
+                    result = operation(*args, **kwargs)
+                except TransientError as e:
+                    self.breaker.failure()
+                    # this call was already admitted: only a breaker its failures opened stops it
+                    if attempt >= self.retry_attempts or self.breaker.is_open():
+                        self._resilience_event("gave_up", e.kind)
+                        raise
+                    self._resilience_event("retry", e.kind)
+                    time.sleep(random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)))
+                except BaseException:
+                    # any other outcome, a permanent database error included, means the database answered
+                    self.breaker.success()
+                    raise
+                else:
+                    self.breaker.success()
+                    return result
+        finally:
+            self._retrying.reset(token)
+
+    def _cache_metrics(self):
+        site = () if self.site is None else (("site", self.site),)
+        return {site + (("cache", cache), ("event", event)): stats[event]
+                for cache, stats in self.cache_stats().items() for event in ("hits", "misses")}
+
+    # hooks
+
+    def _cursor(self, conn):
+        return conn.cursor()
+
+    def _sql(self, statement):
+        return statement
+
+    def _params(self, params):
+        return params
+
+    def _begin(self, cursor):
+        pass
+
+    def _explain(self, cursor, statement, params):
+        raise NotImplementedError
+
+    def _inserted_id(self, cursor):
+        # identity value generated by the INSERT just run on cursor
+        raise NotImplementedError
+
+    def _is_duplicate_key(self, error):
+        # whether the driver error is a primary key or unique constraint violation
+        raise NotImplementedError
+
+    def _transient_kind(self, error):
+        # "deadlock", "timeout", "throttling" or "connection" if the driver error may pass on a retry, else None
+        return None
+
+    def _storage_error(self, error):
+        # a PoolTimeout stays permanent: each attempt already waited PoolTimeout seconds for a connection,
+        # and an exhausted pool says this process is busy, not that the database is failing
+        kind = None if isinstance(error, PoolTimeout) else self._transient_kind(error)
+        return StorageError(error) if kind is None else TransientError(error, kind)
+
+    def _savepoint(self, cursor, name):
+        self._execute(cursor, f"SAVEPOINT {name}")
+
+    def _release_savepoint(self, cursor, name):
+        self._execute(cursor, f"RELEASE SAVEPOINT {name}")
+
+    def _rollback_savepoint(self, cursor, name):
+        self._execute(cursor, f"ROLLBACK TO SAVEPOINT {name}")
+
+    def _execute(self, cursor, statement, params=()):
+        if not metrics.enabled:
+            cursor.execute(self._sql(statement), self._params(params))
+            return
+        start = time.perf_counter()
+        try:
+            cursor.execute(self._sql(statement), self._params(params))
+        finally:
+            metrics.record_query(statement, params, time.perf_counter() - start)
+
+    def _executemany(self, cursor, statement, seq_of_params):
+        seq_of_params = [self._params(params) for params in seq_of_params]
+        if not metrics.enabled:
+            cursor.executemany(self._sql(statement), seq_of_params)
+            return
+        start = time.perf_counter()
+        try:
+            cursor.executemany(self._sql(statement), seq_of_params)
+        finally:
+            metrics.record_query(statement, seq_of_params, time.perf_counter() - start)
+
+    @contextmanager
+    def _connection(self, read_only=False):
+        # read_only: nothing run on the connection writes, so ConnectionManager may send it to the replica
+        batch = self._batch.get()
+        if batch is not None:
+            # inside batch(): every statement shares its connection, which batch() gives back
+            try:
+                yield batch[0]
+            except self.Error as e:
+                raise self._storage_error(e) from e
+            return
+        cm = ConnectionManager(self.site, read_only)
+        try:
+            conn = cm.create_connection()
+        except (self.Error, PoolTimeout) as e:
+            raise self._storage_error(e) from e
+        try:
+            yield conn
+        except self.Error as e:
+            raise self._storage_error(e) from e
+        finally:
+            cm.close_connection()
+
+    @contextmanager
+    def _transaction(self, pin_reads=True):
+        # pin_reads: the commit is a write the session must read back, so its reads skip the replica for a while
+        batch = self._batch.get()
+        if batch is not None:
+            with self._nested_transaction(batch) as cursor:
+                yield cursor
+            return
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            self._begin(cursor)
+            try:
+                yield cursor
+            except RollbackTransaction:
+                conn.rollback()
+                raise
+            self._commit(conn)
+        if pin_reads:
+            self._pin_reads()
+
+    @contextmanager
+    def _nested_transaction(self, batch):
+        # a savepoint per unit of work, so one failing command does not undo the rest of the batch
+        conn, savepoints, calendar_changes = batch
+        name = f"unit{next(savepoints)}"
+        queued = len(calendar_changes)
+        with self._connection():
+            cursor = self._cursor(conn)
+            self._savepoint(cursor, name)
+            try:
+                yield cursor
+            except BaseException:
+                # calendar changes of writes nested in this unit are undone with it
+                del calendar_changes[queued:]
+                try:
+                    self._rollback_savepoint(cursor, name)
+                except self.Error:
+                    # the server already ended the whole transaction (SQL Server does for a deadlock victim),
+                    # taking the savepoint with it; the original error, not this one, says what happened
+                    pass
+                raise
+            self._release_savepoint(cursor, name)
+
+    @contextmanager
+    def batch(self):
+        """
+        Run everything inside the block on one connection and in one
+        transaction, committed when the block exits normally. Each write keeps
+        its own savepoint, so a write that fails is undone alone.
+        """
+        if self._batch.get() is not None:
+            yield
+            return
+        with self._connection() as conn:
+            cursor = self._cursor(conn)
+            self._begin(cursor)
+            # connection, savepoint counter and the calendar changes to apply once the batch commits
+            calendar_changes = []
+            token = self._batch.set((conn, itertools.count(), calendar_changes))
+            try:
+                yield
+            finally:
+                self._batch.reset(token)
+            self._commit(conn)
+        for change in calendar_changes:
+            self._calendar_change(change)
+        self._pin_reads()
+
+    def _commit(self, conn):
+        try:
+            conn.commit()
+        except self.Error as e:
+            # the commit may have reached the database, so it is never reported as transient and retried
+            raise StorageError(e) from e
+
+    def _pin_reads(self):
+        ConnectionManager.wrote(self.site)
+
+    @retried
+    def _query(self, statement, params=(), read_only=False):
+        with self._connection(read_only) as conn:
+            cursor = self._cursor(conn)
+            self._execute(cursor, statement, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def _as_date(value):
+        # dates come back from the drivers as date, datetime or ISO text
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        return datetime.date.fromisoformat(str(value)[:10])
+
+    @staticmethod
+    def week_of(value):
+        # Monday of the date's week, the key of the CaregiverLoad counters
+        day = Storage._as_date(value)
+        return day - datetime.timedelta(days=day.weekday())
+
+    @staticmethod
+    def _date_key(value):
+        # compare dates coming back from any driver with ones passed in
+        return Storage._as_date(value).isoformat()
+
+    @retried
+    def explain(self, statement, params=()):
+        """The backend's plan for statement, one line per step, without running it."""
+        with self._connection() as conn:
+            return self._explain(self._cursor(conn), statement, params)
+
+    def _check_account_table(self, table):
+        if table not in self.ACCOUNT_TABLES:
+            raise ValueError(f"Unknown account table: {table}")
+
+    # accounts
+
+    def get_credentials(self, table, username):
+        # (salt, hash, work factor); the work factor is None for hashes stored before it was recorded
+        self._check_account_table(table)
+        rows = self._query(self.CREDENTIALS_SQL.format(table=table), (username,), read_only=True)
+        if not rows:
+            return None
+        return rows[0]['Salt'], rows[0]['Hash'], rows[0]['WorkFactor']
+
+    def username_exists(self, table, username):
+        self._check_account_table(table)
+        return bool(self._query(f"SELECT Username FROM {table} WHERE Username = %s", (username,), read_only=True))
+
+    def username_taken(self, table, username):
+        """
+        Whether username is known to be taken, as a cheap check before the
+        password hash during mass registration: only names the username
+        filter may have seen are looked up, and with the filter disabled
+        nothing is. False is advisory; add_account() enforces uniqueness.
+        """
+        self._check_account_table(table)
+        usernames = self._username_filter(table)
+        if usernames is None:
+            return False
+        with self._username_filter_lock:
+            # case-folded, as SQL Server's default collation compares usernames case-insensitively
+            seen = username.casefold() in usernames
+            if seen:
+                self._username_filter_misses += 1
+            else:
+                self._username_filter_hits += 1
+        return seen and self.username_exists(table, username)
+
+    def _username_filter(self, table):
+        # the table's username filter, rebuilt when older than UsernameFilterRefresh seconds; None if disabled
+        if not self.username_filter_enabled:
+            return None
+        with self._username_filter_lock:
+            usernames, expires = self._username_filters.get(table, (None, 0.0))
+            if usernames is not None and time.monotonic() < expires:
+                return usernames
+        usernames = self._load_username_filter(table)
+        with self._username_filter_lock:
+            self._username_filters[table] = (usernames, time.monotonic() + self.username_filter_refresh)
+        return usernames
+
+    @retried
+    def _load_username_filter(self, table):
+        usernames = BloomFilter(self.username_filter_capacity)
+        # the filter is advisory, so a replica behind by a few names only costs add_account() a UsernameTaken
+        with self._connection(read_only=True) as conn:
+            cursor = self._cursor(conn)
+            self._execute(cursor, f"SELECT Username FROM {table}")
+            rows = cursor.fetchmany(self.PAGE_SIZE)
+            while rows:
+                for row in rows:
+                    usernames.add(row['Username'].casefold())
+                rows = cursor.fetchmany(self.PAGE_SIZE)
+        return usernames
+
+    @retried
+    def add_account(self, table, username, salt, hash, work_factor):
+        """Insert the account in one statement; raises UsernameTaken if the username is in use."""
+        self._check_account_table(table)
+        try:
+            with self._transaction() as cursor:
+                self._execute(cursor, f"INSERT INTO {table} (Username, Salt, Hash, WorkFactor) VALUES (%s, %s, %s, %d)",
+                              (username, salt, hash, work_factor))
+        except StorageError as e:
+            if self._is_duplicate_key(e.__cause__):
+                raise UsernameTaken(f"Username taken: {username}") from e.__cause__
+            raise
+        with self._username_filter_lock:
+            usernames, expires = self._username_filters.get(table, (None, 0.0))
+        if usernames is not None:
+            usernames.add(username.casefold())
+
+    @retried
+    def update_password_hash(self, table, username, salt, hash, work_factor):
+        self._check_account_table(table)
+        with self._transaction() as cursor:
+            self._execute(cursor, f"UPDATE {table} SET Salt = %s, Hash = %s, WorkFactor = %d WHERE Username = %s",
+                          (salt, hash, work_factor, username))
+
+    # availability
+
+    @retried
+    def add_availability(self, username, d):
+        with self._transaction() as cursor:
+            self._execute(cursor, "INSERT INTO Availabilities (Time, Username) VALUES (%s, %s)", (d, username))
+        self.availability_cache.invalidate(self._as_date(d))
+        self._calendar_change(lambda calendar: calendar.add(username, self._as_date(d)))
+
+    @retried
+    def add_availabilities(self, username, dates):
+        """Insert every date for username in one batched transaction, skipping duplicates; returns the count."""
+        dates = sorted(set(dates))
+        if not dates:
+            return 0
+        add_availability = "INSERT INTO Availabilities (Time, Username) VALUES (%s, %s)"
+        with self._transaction() as cursor:
+            self._execute(cursor, self.UPLOADED_DATES_SQL, (username, dates[0], dates[-1]))
+            uploaded = {self._date_key(row['Time']) for row in cursor.fetchall()}
+            new_dates = [d for d in dates if self._date_key(d) not in uploaded]
+            if new_dates:
+                self._executemany(cursor, add_availability, [(d, username) for d in new_dates])
+        self.availability_cache.invalidate(*(self._as_date(d) for d in new_dates))
+        self._calendar_change(lambda calendar: calendar.add_many(username, [self._as_date(d) for d in new_dates]))
+        return len(new_dates)
+
+    def available_caregivers(self, d):
+        calendar = self._availability_calendar()
+        if calendar is not None:
+            return calendar.members_on(self._as_date(d))
+
+        def load():
+            rows = self._query(self.CAREGIVERS_ON_DATE_SQL, (d,))
+            return tuple(row['Username'] for row in rows)
+        if self._batch.get() is not None:
+            # a batch sees its own uncommitted writes, which must not reach the shared cache
+            return list(load())
+        return list(self.availability_cache.get_or_load(self._as_date(d), load))
+
+    def availability_by_day_sql(self):
+        # every day's caregivers in a date range, one row per day
+        return f"""
+            SELECT Time, {self.USERNAME_LIST_SQL} AS Usernames
+            FROM Availabilities
+            WHERE Time BETWEEN %s AND %s
+            GROUP BY Time
+        """
+
+    def availability_by_day(self, first, last):
+        """{date: [caregiver usernames, sorted]} for every day in [first, last] with availability, in one query."""
+        calendar = self._availability_calendar()
+        if calendar is not None:
+            return calendar.members_by_day(self._as_date(first), self._as_date(last))
+        generation = self.availability_cache.generation()
+        by_day = {}
+        for row in self._query(self.availability_by_day_sql(), (first, last)):
+            usernames = sorted(row['Usernames'].split(self.USERNAME_SEPARATOR))
+            by_day[self._as_date(row['Time'])] = usernames
+        if self._batch.get() is not None:
+            return by_day
+        # the range result answers the single-date lookups too
+        first, last = self._as_date(first), self._as_date(last)
+        for i in range((last - first).days + 1):
+            day = first + datetime.timedelta(days=i)
+            self.availability_cache.put(day, tuple(by_day.get(day, ())), generation)
+        return by_day
+
+    # shifts
+
+    @retried
+    def add_shifts(self, username, dates, start, end, slot_minutes):
+        """
+        Publish a shift [start, end) (minutes after midnight) split into
+        slot_minutes slots on every date for username, in one batched
+        transaction, skipping dates where it would overlap a shift already
+        there; returns the count added.
+        """
+        if not 0 <= start < end <= 24 * 60 or slot_minutes <= 0 or end - start < slot_minutes:
+            raise ValueError("Invalid shift")
+        dates = sorted(set(dates))
+        if not dates:
+            return 0
+        select_overlapping = """
+            SELECT Date FROM Shifts
+            WHERE Username = %s AND Date BETWEEN %s AND %s AND StartMinute < %d AND EndMinute > %d
+        """
+        add_shift = """
+            INSERT INTO Shifts (Date, Username, StartMinute, EndMinute, SlotMinutes) VALUES (%s, %s, %d, %d, %d)
+        """
+        with self._transaction() as cursor:
+            self._execute(cursor, select_overlapping, (username, dates[0], dates[-1], end, start))
+            taken = {self._date_key(row['Date']) for row in cursor.fetchall()}
+            new_dates = [d for d in dates if self._date_key(d) not in taken]
+            if new_dates:
+                self._executemany(cursor, add_shift, [(d, username, start, end, slot_minutes) for d in new_dates])
+        self.shift_cache.invalidate(*(self._as_date(d) for d in new_dates))
+        return len(new_dates)
+
+    def shift_index(self, d):
+        """The ShiftIndex of d's shifts and booked slots, read through shift_cache."""
+        def load():
+            shifts = [(row['StartMinute'], row['EndMinute'], row['SlotMinutes'], row['Username'])
+                      for row in self._query(self.SHIFTS_SQL, (d,))]
+            if not shifts:
+                return ShiftIndex()
+            booked = [(row['Caregiver'], row['Slot']) for row in self._query(self.BOOKED_SLOTS_SQL, (d, d))]
+            return ShiftIndex(shifts, booked)
+        if self._batch.get() is not None:
+            # a batch sees its own uncommitted bookings, which must not reach the shared cache
+            return load()
+        return self.shift_cache.get_or_load(self._as_date(d), load)
+
+    def shift_slots_by_day(self, first, last):
+        """{date: total slots in its shifts, booked or not} for every day in [first, last] with shifts."""
+        rows = self._query("""
+            SELECT Date, SUM((EndMinute - StartMinute) / SlotMinutes) AS Slots
+            FROM Shifts
+            WHERE Date BETWEEN %s AND %s
+            GROUP BY Date
+        """, (first, last), read_only=True)
+        return {self._as_date(row['Date']): row['Slots'] for row in rows}
+
+    # vaccines
+
+    def get_vaccine_doses(self, name):
+        return dict(self.vaccines()).get(name)
+
+    def vaccines(self):
+        def load():
+            return tuple((row['Name'], row['Doses']) for row in self._query("SELECT Name, Doses FROM Vaccines"))
+        if self._batch.get() is not None:
+            return list(load())
+        return list(self.vaccine_cache.get_or_load(self.VACCINES, load))
+
+    def vaccine_interval(self, name):
+        """Days between the doses of name's series, or None for a single-dose (or unknown) vaccine."""
+        def load():
+            rows = self._query("SELECT Name, IntervalDays FROM Vaccines WHERE IntervalDays IS NOT NULL")
+            return {row['Name']: row['IntervalDays'] for row in rows}
+        if self._batch.get() is not None:
+            return load().get(name)
+        return self.vaccine_cache.get_or_load(self.VACCINE_INTERVALS, load).get(name)
+
+    @retried
+    def set_vaccine_interval(self, name, days):
+        """Set the days between name's doses (None: single dose); False if there is no such vaccine."""
+        with self._transaction() as cursor:
+            self._execute(cursor, "UPDATE Vaccines SET IntervalDays = %s WHERE Name = %s", (days, name))
+            updated = cursor.rowcount == 1
+        self.vaccine_cache.invalidate(self.VACCINE_INTERVALS)
+        return updated
+
+    @retried
+    def add_vaccine(self, name, doses):
+        with self._transaction() as cursor:
+            self._execute(cursor, "INSERT INTO Vaccines (Name, Doses) VALUES (%s, %d)", (name, doses))
+        self.vaccine_cache.invalidate(self.VACCINES)
+
+    @retried
+    def decrease_vaccine_doses(self, name, num):
+        """Take num doses server-side and return the new total, or None if fewer than num are left."""
+        with self._transaction() as cursor:
+            self._execute(cursor, "UPDATE Vaccines SET Doses = Doses - %d WHERE Name = %s AND Doses >= %d",
+                          (num, name, num))
+            if cursor.rowcount != 1:
+                return None
+            self._execute(cursor, "SELECT Doses FROM Vaccines WHERE Name = %s", (name,))
+            row = cursor.fetchone()
+        self.vaccine_cache.invalidate(self.VACCINES)
+        return row['Doses']
+
+    @retried
+    def increase_vaccine_doses(self, name, num):
+        """Add num doses server-side and return the new total."""
+        with self._transaction() as cursor:
+            self._execute(cursor, "UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s", (num, name))
+            self._execute(cursor, "SELECT Doses FROM Vaccines WHERE Name = %s", (name,))
+            row = cursor.fetchone()
+        self.vaccine_cache.invalidate(self.VACCINES)
+        return row['Doses'] if row else None
+
+    @retried
+    def add_doses(self, doses):
+        """
+        Add doses ({name: count}) with server-side increments, inserting vaccines
+        not seen before, as one upsert batch in one transaction.
+        """
+        items = list(doses.items())
+        with self._transaction() as cursor:
+            for i in range(0, len(items), self.UPSERT_BATCH):
+                batch = items[i:i + self.UPSERT_BATCH]
+                self._execute(cursor, self._upsert_doses_sql(len(batch)),
+                              tuple(param for row in batch for param in row))
+        self.vaccine_cache.invalidate(self.VACCINES)
+        return len(items)
+
+    def _upsert_doses_sql(self, rows):
+        raise NotImplementedError
+
+    def dose_usage(self, first, last):
+        """{vaccine: (doses booked in [first, last], doses booked on its busiest day)} for every booked vaccine."""
+        return {row['Vaccine']: (row['Total'], row['Peak']) for row in self._query(self.DOSE_USAGE_SQL, (first, last))}
+
+    # appointments
+
+    @retried
+    def reserve(self, d, vaccine, patient, not_before=None):
+        """
+        Book the earliest free shift slot on d (at or after not_before minutes
+        after midnight, if given), or else claim a caregiver's whole-day
+        availability for d, taking one dose of vaccine and bumping the
+        caregiver's weekly booking counter in the same transaction. Whole-day
+        caregivers are picked by the configured assignment strategy and are
+        only tried when no time was asked for.
+        Returns (outcome, caregiver, appointment_id, slot); slot is None for a whole-day booking.
+        """
+        try:
+            result = self._attempt(self._reserve_slot, d, vaccine, patient, not_before or 0)
+            if result[0] == self.NO_CAREGIVER and not_before is None:
+                result = self._attempt(self._reserve, d, vaccine, patient) + (None,)
+            outcome, caregiver = result[:2]
+            if outcome == self.RESERVED:
+                self.assignment.assigned(caregiver, d)
+                if result[3] is None:
+                    self._calendar_change(lambda calendar: calendar.remove(caregiver, self._as_date(d)))
+            return result
+        finally:
+            # even a failed attempt tells us the cached view of d may be stale
+            self.availability_cache.invalidate(self._as_date(d))
+            self.shift_cache.invalidate(self._as_date(d))
+            self.vaccine_cache.invalidate(self.VACCINES)
+
+    @staticmethod
+    def _attempt(reserve, *args):
+        try:
+            return reserve(*args)
+        except RollbackTransaction as e:
+            return e.result
+
+    def _reserve(self, d, vaccine, patient):
+        raise NotImplementedError
+
+    @staticmethod
+    def weekly_bookings_sql(caregivers):
+        # the CaregiverLoad counters of the given caregivers for one week, as one statement
+        return f"""
+            SELECT Username, Booked FROM CaregiverLoad
+            WHERE Week = %s AND Username IN ({", ".join(["%s"] * caregivers)})
+        """
+
+    def weekly_bookings(self, d, caregivers):
+        """{caregiver: bookings in the week of d} for those of caregivers with any."""
+        caregivers = list(caregivers)
+        if not caregivers:
+            return {}
+        rows = self._query(self.weekly_bookings_sql(len(caregivers)), (self.week_of(d),) + tuple(caregivers))
+        return {row['Username']: row['Booked'] for row in rows}
+
+    @staticmethod
+    def open_dates_sql(dates):
+        # the dates among the given ones with a whole-day caregiver or a shift, as one statement
+        placeholders = ", ".join(["%s"] * dates)
+        return f"""
+            SELECT Time AS Date FROM Availabilities WHERE Time IN ({placeholders})
+            UNION
+            SELECT Date FROM Shifts WHERE Date IN ({placeholders})
+        """
+
+    @retried
+    def reserve_series(self, dates, vaccine, patient, not_before=None):
+        """
+        Book one dose of vaccine on each of dates (a series, e.g. first and
+        second dose), all or none, in one transaction. One query first checks
+        every date has some capacity, so a series that cannot fit fails before
+        anything is locked; each dose is then booked as reserve() books it.
+        Returns (outcome, failed date or None, [(date, caregiver, appointment_id, slot)] booked).
+        """
+        dates = list(dates)
+        rows = self._query(self.open_dates_sql(len(dates)), tuple(dates) * 2)
+        open_dates = {self._date_key(row['Date']) for row in rows}
+        for d in dates:
+            if self._date_key(d) not in open_dates:
+                return self.NO_CAREGIVER, d, []
+        # batch() lets each dose's reservation nest inside the series transaction as a savepoint
+        with self.batch():
+            try:
+                with self._transaction():
+                    booked = []
+                    for d in dates:
+                        outcome, caregiver, appointment_id, slot = self.reserve(d, vaccine, patient, not_before)
+                        if outcome != self.RESERVED:
+                            raise RollbackTransaction((outcome, d, []))
+                        booked.append((d, caregiver, appointment_id, slot))
+                return self.RESERVED, None, booked
+            except RollbackTransaction as e:
+                return e.result
+
+    def _reserve_slot(self, d, vaccine, patient, not_before):
+        # the index only proposes candidates; _book_slot() re-checks each in the transaction,
+        # so a stale index costs a retry on the next candidate, never a double booking.
+        # Caregivers free at the same time are tried in the assignment strategy's order
+        index = self.shift_index(d)
+        if not len(index):
+            return self.NO_CAREGIVER, None, None, None
+        rank = {caregiver: i for i, caregiver in enumerate(self.assignment.order(self, d, index.members()))}
+        candidates = list(itertools.islice(index.free_slots(not_before, rank), self.SLOT_ATTEMPTS))
+        if not candidates:
+            return self.NO_CAREGIVER, None, None, None
+        with self._transaction() as cursor:
+            self._execute(cursor, self.TAKE_DOSE_SQL, (vaccine,))
+            if cursor.rowcount != 1:
+                raise RollbackTransaction((self.NO_DOSES, None, None, None))
+            for slot, caregiver in candidates:
+                appointment_id = self._book_slot(cursor, d, caregiver, patient, vaccine, slot)
+                if appointment_id is not None:
+                    break
+            else:
+                raise RollbackTransaction((self.SLOT_LOST, None, None, None))
+            self._execute(cursor, self._count_booking_sql(), (caregiver, self.week_of(d)))
+        return self.RESERVED, caregiver, appointment_id, slot
+
+    def _book_slot(self, cursor, d, caregiver, patient, vaccine, slot):
+        # insert the appointment if caregiver still has a shift covering slot and nobody booked it; its id or None
+        raise NotImplementedError
+
+    def _count_booking_sql(self):
+        # add one booking to CaregiverLoad for (Username, Week), creating the row if needed
+        raise NotImplementedError
+
+    @retried
+    def cancel_appointment(self, appointment_id, table, username):
+        """
+        Delete an appointment of username (a patient or caregiver of it) and, in
+        the same transaction, give the caregiver their day back (a shift slot
+        frees itself with the row), return the dose and uncount the booking. Returns the cancelled row, or None if
+        username has no such appointment.
+        """
+        self._check_account_table(table)
+        user_column = "Patient" if table == self.PATIENTS else "Caregiver"
+        select_appointment = f"""
+            SELECT Appointment_id, Date, Caregiver, Patient, Vaccine, Slot FROM Appointments
+            WHERE Appointment_id = %d AND {user_column} = %s
+        """
+        # the caregiver may have uploaded the date again since it was booked
+        restore_slot = """
+            INSERT INTO Availabilities (Time, Username)
+            SELECT %s, %s WHERE NOT EXISTS (SELECT 1 FROM Availabilities WHERE Time = %s AND Username = %s)
+        """
+        try:
+            with self._transaction() as cursor:
+                self._execute(cursor, select_appointment, (appointment_id, username))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                row = dict(row, Date=self._as_date(row['Date']))
+                self._execute(cursor, "DELETE FROM Appointments WHERE Appointment_id = %d", (appointment_id,))
+                if cursor.rowcount != 1:
+                    # cancelled concurrently
+                    raise RollbackTransaction(None)
+                if row['Slot'] is None:
+                    self._execute(cursor, restore_slot, (row['Date'], row['Caregiver'], row['Date'], row['Caregiver']))
+                self._execute(cursor, "UPDATE Vaccines SET Doses = Doses + 1 WHERE Name = %s", (row['Vaccine'],))
+                self._execute(cursor, """
+                    UPDATE CaregiverLoad SET Booked = Booked - 1 WHERE Username = %s AND Week = %s AND Booked > 0
+                """, (row['Caregiver'], self.week_of(row['Date'])))
+        except RollbackTransaction as e:
+            return e.result
+        self.availability_cache.invalidate(row['Date'])
+        self.shift_cache.invalidate(row['Date'])
+        self.vaccine_cache.invalidate(self.VACCINES)
+        if row['Slot'] is None:
+            self._calendar_change(lambda calendar: calendar.add(row['Caregiver'], row['Date']))
+        return row
+
+    @retried
+    def cancel_day(self, caregiver, d):
+        """
+        Cancel every appointment caregiver has on d and withdraw their
+        availability and shifts for it, as a handful of set-based statements in one
+        transaction: doses go back per vaccine and the weekly load drops by the
+        number cancelled. Returns the cancelled rows.
+        """
+        on_day = "FROM Appointments WHERE Caregiver = %s AND Date = %s"
+        with self._transaction() as cursor:
+            self._execute(cursor, f"SELECT Appointment_id, Date, Caregiver, Patient, Vaccine, Slot {on_day} "
+                                  "ORDER BY Appointment_id", (caregiver, d))
+            rows = [dict(row, Date=self._as_date(row['Date'])) for row in cursor.fetchall()]
+            if rows:
+                self._execute(cursor, f"""
+                    UPDATE Vaccines SET Doses = Doses + (SELECT COUNT(*) {on_day} AND Vaccine = Vaccines.Name)
+                    WHERE Name IN (SELECT Vaccine {on_day})
+                """, (caregiver, d, caregiver, d))
+                self._execute(cursor, """
+                    UPDATE CaregiverLoad SET Booked = CASE WHEN Booked > %d THEN Booked - %d ELSE 0 END
+                    WHERE Username = %s AND Week = %s
+                """, (len(rows), len(rows), caregiver, self.week_of(d)))
+                self._execute(cursor, f"DELETE {on_day}", (caregiver, d))
+            self._execute(cursor, "DELETE FROM Availabilities WHERE Username = %s AND Time = %s", (caregiver, d))
+            self._execute(cursor, "DELETE FROM Shifts WHERE Date = %s AND Username = %s", (d, caregiver))
+        self.availability_cache.invalidate(self._as_date(d))
+        self.shift_cache.invalidate(self._as_date(d))
+        self.vaccine_cache.invalidate(self.VACCINES)
+        self._calendar_change(lambda calendar: calendar.remove(caregiver, self._as_date(d)))
+        return rows
+
+    def appointments(self, table, username):
+        return list(self.iter_appointments(table, username))
+
+    def appointments_sql(self, table, rows, first=False, last=False):
+        # one keyset page of an account's appointments, run with (username, after[, first date][, last date])
+        if table == self.PATIENTS:
+            columns, user_column = "Appointment_id, Vaccine, Date, Slot, Caregiver", "Patient"
+        else:
+            columns, user_column = "Appointment_id, Vaccine, Date, Slot, Patient", "Caregiver"
+        filters = (" AND Date >= %s" if first else "") + (" AND Date <= %s" if last else "")
+        return f"""
+            SELECT {self.TOP_SQL.format(rows=rows)} {columns}
+            FROM Appointments
+            WHERE {user_column} = %s AND Appointment_id > %d{filters}
+            ORDER BY Appointment_id
+            {self.LIMIT_SQL.format(rows=rows)}
+        """
+
+    def iter_appointments(self, table, username, after=0, limit=None, first=None, last=None, page_size=None):
+        """
+        Yield the user's appointments in Appointment_id order, optionally only
+        ids above after and dates within [first, last], at most limit of them.
+        Rows are fetched in keyset-paginated pages of page_size, so memory stays
+        constant and no connection is held while the caller consumes a page.
+        The counterpart's name is returned under the other role's column.
+        """
+        self._check_account_table(table)
+        filter_params = tuple(d for d in (first, last) if d is not None)
+        page_size = page_size or self.PAGE_SIZE
+
+        remaining = limit
+        while remaining is None or remaining > 0:
+            rows_wanted = page_size if remaining is None else min(page_size, remaining)
+            statement = self.appointments_sql(table, rows_wanted, first is not None, last is not None)
+            rows = self._query(statement, (username, after) + filter_params, read_only=True)
+            for row in rows:
+                yield row
+            if len(rows) < rows_wanted:
+                return
+            after = rows[-1]['Appointment_id']
+            if remaining is not None:
+                remaining -= len(rows)
+
+    # waitlist
+
+    @retried
+    def add_waitlist(self, patient, vaccine, first, last):
+        """Queue patient for the first opening with vaccine between first and last; returns the Request_id."""
+        with self._transaction() as cursor:
+            self._execute(cursor, """
+                INSERT INTO Waitlist (Patient, Vaccine, FirstDate, LastDate) VALUES (%s, %s, %s, %s)
+            """, (patient, vaccine, first, last))
+            return self._inserted_id(cursor)
+
+    def waitlist_requests(self, patient):
+        rows = self._query("""
+            SELECT Request_id, Vaccine, FirstDate, LastDate FROM Waitlist WHERE Patient = %s ORDER BY Request_id
+        """, (patient,))
+        return [dict(row, FirstDate=self._as_date(row['FirstDate']), LastDate=self._as_date(row['LastDate']))
+                for row in rows]
+
+    def iter_waitlist(self, first, last, vaccines=None, page_size=None):
+        """
+        Yield the waiting requests whose date range overlaps [first, last],
+        optionally only for the given vaccines, oldest first, in keyset pages
+        like iter_appointments().
+        """
+        filters, filter_params = "", ()
+        if vaccines is not None:
+            filter_params = tuple(vaccines)
+            if not filter_params:
+                return
+            filters = f" AND Vaccine IN ({', '.join(['%s'] * len(filter_params))})"
+        page_size = page_size or self.PAGE_SIZE
+        statement = f"""
+            SELECT {self.TOP_SQL.format(rows=page_size)} Request_id, Patient, Vaccine, FirstDate, LastDate
+            FROM Waitlist
+            WHERE Request_id > %d AND FirstDate <= %s AND LastDate >= %s{filters}
+            ORDER BY Request_id
+            {self.LIMIT_SQL.format(rows=page_size)}
+        """
+        after = 0
+        while True:
+            rows = self._query(statement, (after, last, first) + filter_params)
+            for row in rows:
+                yield dict(row, FirstDate=self._as_date(row['FirstDate']), LastDate=self._as_date(row['LastDate']))
+            if len(rows) < page_size:
+                return
+            after = rows[-1]['Request_id']
+
+    @retried
+    def book_waitlisted(self, request_id, d, vaccine, patient):
+        """
+        Take request_id off the waitlist and reserve d for it, both or neither.
+        Returns the reserve() result, or None when another matcher already took the request.
+        """
+        # batch() lets the reservation nest inside the waitlist transaction as a savepoint
+        with self.batch():
+            try:
+                with self._transaction() as cursor:
+                    self._execute(cursor, "DELETE FROM Waitlist WHERE Request_id = %d", (request_id,))
+                    if cursor.rowcount != 1:
+                        raise RollbackTransaction(None)
+                    result = self.reserve(d, vaccine, patient)
+                    if result[0] != self.RESERVED:
+                        raise RollbackTransaction(result)
+                return result
+            except RollbackTransaction as e:
+                return e.result
+
+
+# one Storage per site, the unsited database under None
+_storages = {}
+_storage_lock = threading.Lock()
+
+
+def get_storage(site=None):
+    """
+    The process-wide Storage of site, by default the current site of
+    db.SiteRouter (the only database when no sites are configured), for the
+    backend ConnectionManager is configured with there.
+    """
+    if site is None:
+        site = get_router().current()
+    storage = _storages.get(site)
+    if storage is None:
+        with _storage_lock:
+            storage = _storages.get(site)
+            if storage is None:
+                if ConnectionManager(site).backend == "sqlite":
+                    from db.SqliteStorage import SqliteStorage
+                    storage = SqliteStorage(site)
+                else:
+                    from db.MssqlStorage import MssqlStorage
+                    storage = MssqlStorage(site)
+                # bring the database up to the schema this code expects before anything uses it
+                Schema(storage).migrate()
+                _storages[site] = storage
+                metrics.collectors["scheduler_cache_events"] = _cache_metrics
+                metrics.collectors["scheduler_read_routes"] = ConnectionManager.read_routes
+                metrics.collectors["scheduler_db_resilience_events"] = _resilience_metrics
+    return storage
+
+
+def _cache_metrics():
+    # every site's cache counters, labelled with the site
+    return {labels: value for storage in list(_storages.values()) for labels, value in storage._cache_metrics().items()}
+
+
+def _resilience_metrics():
+    # every site's retries, give-ups and circuit breaker events, labelled with the site
+    return {labels: value for storage in list(_storages.values())
+            for labels, value in storage._resilience_metrics().items()}
+
+
+def set_storage(storage):
+    with _storage_lock:
+        _storages[storage.site] = storage
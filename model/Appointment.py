@@ -0,0 +1,64 @@
+import sys
+sys.path.append("../db/*")
+from db.Storage import Storage, get_storage
+
+
+class Appointment:
+    # outcomes of reserve()
+    RESERVED = Storage.RESERVED
+    NO_CAREGIVER = Storage.NO_CAREGIVER
+    SLOT_LOST = Storage.SLOT_LOST
+    NO_DOSES = Storage.NO_DOSES
+
+    def __init__(self, date, vaccine_name, patient, caregiver=None, appointment_id=None, slot=None):
+        self.date = date
+        self.vaccine_name = vaccine_name
+        self.patient = patient
+        self.caregiver = caregiver
+        self.appointment_id = appointment_id
+        # start of the booked shift slot in minutes after midnight, None for a whole-day booking
+        self.slot = slot
+
+    def get_appointment_id(self):
+        return self.appointment_id
+
+    def get_caregiver(self):
+        return self.caregiver
+
+    # "HH:MM" of the booked slot, or None for a whole-day booking
+    def get_time(self):
+        return None if self.slot is None else f"{self.slot // 60:02d}:{self.slot % 60:02d}"
+
+    # Book the earliest free slot (at or after not_before minutes after midnight) or a caregiver's day,
+    # take one dose and book the appointment in one transaction
+    def reserve(self, not_before=None):
+        outcome, caregiver, appointment_id, slot = get_storage().reserve(self.date, self.vaccine_name, self.patient,
+                                                                         not_before)
+        if outcome == Appointment.RESERVED:
+            self.caregiver = caregiver
+            self.appointment_id = appointment_id
+            self.slot = slot
+        return outcome
+
+    # Book a dose on each of dates for patient, all or none, in one transaction.
+    # Returns (outcome, date that could not be booked or None, [Appointment per dose])
+    @staticmethod
+    def reserve_series(dates, vaccine_name, patient, not_before=None):
+        outcome, failed, booked = get_storage().reserve_series(dates, vaccine_name, patient, not_before)
+        return outcome, failed, [Appointment(d, vaccine_name, patient, caregiver, appointment_id, slot)
+                                 for d, caregiver, appointment_id, slot in booked]
+
+    # Cancel appointment_id if username (of table) is its patient or caregiver; the slot and dose are
+    # returned in the same transaction. Returns the cancelled Appointment or None
+    @staticmethod
+    def cancel(appointment_id, table, username):
+        row = get_storage().cancel_appointment(appointment_id, table, username)
+        if row is None:
+            return None
+        return Appointment(row['Date'], row['Vaccine'], row['Patient'], row['Caregiver'], row['Appointment_id'],
+                           row['Slot'])
+
+    def __str__(self):
+        time = "" if self.slot is None else f", Time: {self.get_time()}"
+        return f"(Appointment ID: {self.appointment_id}, Vaccine: {self.vaccine_name}, Date: {self.date}{time}, " \
+               f"Caregiver: {self.caregiver}, Patient: {self.patient})"
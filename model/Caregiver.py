@@ -0,0 +1,71 @@
+import sys
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.Util import Util
+from db.Storage import Storage, get_storage
+
+
+class Caregiver:
+    def __init__(self, username, password=None, salt=None, hash=None, work_factor=None):
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.hash = hash
+        self.work_factor = Util.WORK_FACTOR if work_factor is None else work_factor
+
+    # getters
+    def get(self):
+        credentials = get_storage().get_credentials(Storage.CAREGIVERS, self.username)
+        if credentials is None:
+            return None
+        curr_salt, curr_hash, curr_work_factor = credentials
+        if curr_work_factor is None:
+            curr_work_factor = Util.LEGACY_WORK_FACTOR
+        if not Util.verify_hash(self.password, curr_salt, curr_hash, curr_work_factor):
+            # print("Incorrect password")
+            return None
+        self.salt = curr_salt
+        self.hash = bytes(curr_hash)
+        self.work_factor = curr_work_factor
+        if curr_work_factor != Util.WORK_FACTOR:
+            # the work factor changed since this hash was stored: rehash while we know the password
+            self.salt = Util.generate_salt()
+            self.work_factor = Util.WORK_FACTOR
+            self.hash = Util.generate_hash(self.password, self.salt, self.work_factor)
+            get_storage().update_password_hash(Storage.CAREGIVERS, self.username, self.salt, self.hash,
+                                               self.work_factor)
+        return self
+
+    def get_username(self):
+        return self.username
+
+    def get_salt(self):
+        return self.salt
+
+    def get_hash(self):
+        return self.hash
+
+    def get_work_factor(self):
+        return self.work_factor
+
+    # one insert; raises db.Storage.UsernameTaken if the username is already in use
+    def save_to_db(self):
+        get_storage().add_account(Storage.CAREGIVERS, self.username, self.salt, self.hash, self.work_factor)
+
+    # Insert availability with parameter date d
+    def upload_availability(self, d):
+        get_storage().add_availability(self.username, d)
+
+    # Insert availability for every date in dates in one batch; returns how many were new
+    def upload_availabilities(self, dates):
+        return get_storage().add_availabilities(self.username, dates)
+
+    # Publish a shift [start, end) in minutes after midnight, split into slot_minutes slots, on every date;
+    # dates where it would overlap a shift already there are skipped. Returns how many were added
+    def upload_shifts(self, dates, start, end, slot_minutes):
+        return get_storage().add_shifts(self.username, dates, start, end, slot_minutes)
+
+    # Cancel all of this caregiver's appointments on d and withdraw the availability and shifts;
+    # returns the cancelled rows
+    def cancel_day(self, d):
+        return get_storage().cancel_day(self.username, d)
@@ -0,0 +1,60 @@
+import sys
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.Util import Util
+from db.Storage import Storage, UsernameTaken, get_storage
+
+
+class Patient:
+    def __init__(self, username, password=None, salt=None, hash=None, work_factor=None):
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.hash = hash
+        self.work_factor = Util.WORK_FACTOR if work_factor is None else work_factor
+
+    # getters
+    def get(self):
+        credentials = get_storage().get_credentials(Storage.PATIENTS, self.username)
+        if credentials is None:
+            return None
+        curr_salt, curr_hash, curr_work_factor = credentials
+        if curr_work_factor is None:
+            curr_work_factor = Util.LEGACY_WORK_FACTOR
+        if not Util.verify_hash(self.password, curr_salt, curr_hash, curr_work_factor):
+            # print("Incorrect password")
+            return None
+        self.salt = curr_salt
+        self.hash = bytes(curr_hash)
+        self.work_factor = curr_work_factor
+        if curr_work_factor != Util.WORK_FACTOR:
+            # the work factor changed since this hash was stored: rehash while we know the password
+            self.salt = Util.generate_salt()
+            self.work_factor = Util.WORK_FACTOR
+            self.hash = Util.generate_hash(self.password, self.salt, self.work_factor)
+            get_storage().update_password_hash(Storage.PATIENTS, self.username, self.salt, self.hash,
+                                               self.work_factor)
+        return self
+
+    def get_username(self):
+        return self.username
+
+    def get_salt(self):
+        return self.salt
+
+    def get_hash(self):
+        return self.hash
+
+    def get_work_factor(self):
+        return self.work_factor
+
+    # one insert; raises db.Storage.UsernameTaken if the username is already in use
+    def save_to_db(self):
+        get_storage().add_account(Storage.PATIENTS, self.username, self.salt, self.hash, self.work_factor)
+
+    # Copy the account to the current site's database unless it is already there
+    def copy_to_db(self):
+        try:
+            self.save_to_db()
+        except UsernameTaken:
+            pass
@@ -0,0 +1,83 @@
+import datetime
+import sys
+sys.path.append("../db/*")
+from db.Storage import get_storage
+
+
+class Vaccine:
+    def __init__(self, vaccine_name, available_doses, interval_days=None):
+        self.vaccine_name = vaccine_name
+        self.available_doses = available_doses
+        # days between the doses of the series, None for a single-dose vaccine
+        self.interval_days = interval_days
+
+    # getters
+    def get(self):
+        doses = get_storage().get_vaccine_doses(self.vaccine_name)
+        if doses is None:
+            return None
+        self.available_doses = doses
+        self.interval_days = get_storage().vaccine_interval(self.vaccine_name)
+        return self
+
+    def get_vaccine_name(self):
+        return self.vaccine_name
+
+    def get_available_doses(self):
+        return self.available_doses
+
+    def get_interval_days(self):
+        return self.interval_days
+
+    # Dates of every dose in a series starting on first: two doses interval_days apart, or just first
+    def series_dates(self, first):
+        if self.interval_days is None:
+            return [first]
+        return [first, first + datetime.timedelta(days=self.interval_days)]
+
+    # Set the days between doses (None makes the vaccine single-dose); False if the vaccine is not stocked
+    def set_interval(self, days):
+        if days is not None and days <= 0:
+            raise ValueError("Argument cannot be negative!")
+        if not get_storage().set_vaccine_interval(self.vaccine_name, days):
+            return False
+        self.interval_days = days
+        return True
+
+    def save_to_db(self):
+        if self.available_doses is None or self.available_doses <= 0:
+            raise ValueError("Argument cannot be negative!")
+        get_storage().add_vaccine(self.vaccine_name, self.available_doses)
+
+    # Insert the vaccine with available_doses, or add them to the existing entry
+    def add_to_db(self):
+        if self.available_doses is None or self.available_doses <= 0:
+            raise ValueError("Argument cannot be negative!")
+        get_storage().add_doses({self.vaccine_name: self.available_doses})
+
+    # Add doses for many vaccines ({name: doses}) in one upsert batch
+    @staticmethod
+    def add_doses_bulk(doses):
+        if any(num <= 0 for num in doses.values()):
+            raise ValueError("Argument cannot be negative!")
+        return get_storage().add_doses(doses)
+
+    # Increment the available doses
+    def increase_available_doses(self, num):
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
+        # incremented server-side so concurrent updates are not lost
+        self.available_doses = get_storage().increase_vaccine_doses(self.vaccine_name, num)
+
+    # Decrement the available doses
+    def decrease_available_doses(self, num):
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
+        # taken server-side, and only while enough are left, so concurrent updates are not lost
+        doses = get_storage().decrease_vaccine_doses(self.vaccine_name, num)
+        if doses is None:
+            raise ValueError("Not enough available doses!")
+        self.available_doses = doses
+
+    def __str__(self):
+        return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
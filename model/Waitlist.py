@@ -0,0 +1,94 @@
+import datetime
+import os
+import sys
+sys.path.append("../db/*")
+from db.Storage import Storage, get_storage
+from model.Appointment import Appointment
+
+
+class Waitlist:
+    # bookings committed together while the waitlist is drained
+    BATCH = int(os.getenv("WaitlistBatch", "50"))
+
+    def __init__(self, patient, vaccine_name, first, last, request_id=None):
+        self.patient = patient
+        self.vaccine_name = vaccine_name
+        self.first = first
+        self.last = last
+        self.request_id = request_id
+
+    def get_request_id(self):
+        return self.request_id
+
+    def save_to_db(self):
+        if self.last < self.first:
+            raise ValueError("Invalid date range")
+        self.request_id = get_storage().add_waitlist(self.patient, self.vaccine_name, self.first, self.last)
+
+    # Waiting requests of a patient, oldest first
+    @staticmethod
+    def requests_of(patient):
+        return [Waitlist(patient, row['Vaccine'], row['FirstDate'], row['LastDate'], row['Request_id'])
+                for row in get_storage().waitlist_requests(patient)]
+
+    @staticmethod
+    def match(first, last, vaccines=None):
+        """
+        Book waiting patients into openings between first and last, oldest
+        request first, optionally only for the given vaccines. Requests are
+        read page by page and bookings are committed BATCH at a time; matching
+        stops once every day in the range is full. Returns the Appointments booked.
+        """
+        storage = get_storage()
+        first, last = Waitlist._day(first), Waitlist._day(last)
+        # whole-day caregivers plus shift slots left per day, kept up to date as we book so full days are not
+        # retried; booked shift slots are counted too, so this can only overestimate what is left
+        open_slots = {day: len(caregivers) for day, caregivers in storage.availability_by_day(first, last).items()}
+        for day, slots in storage.shift_slots_by_day(first, last).items():
+            open_slots[day] = open_slots.get(day, 0) + slots
+        out_of_doses = set()
+        booked = []
+        requests = storage.iter_waitlist(first, last, vaccines)
+        while any(open_slots.values()):
+            with storage.batch():
+                count = 0
+                for request in requests:
+                    appointment = Waitlist._book(storage, request, first, last, open_slots, out_of_doses)
+                    if appointment is not None:
+                        booked.append(appointment)
+                        count += 1
+                    if count == Waitlist.BATCH or not any(open_slots.values()):
+                        break
+                else:
+                    break
+        return booked
+
+    @staticmethod
+    def _book(storage, request, first, last, open_slots, out_of_doses):
+        # the earliest open day in the request's range, or None
+        vaccine = request['Vaccine']
+        if vaccine in out_of_doses:
+            return None
+        low, high = max(first, request['FirstDate']), min(last, request['LastDate'])
+        for day in sorted(d for d, left in open_slots.items() if left > 0 and low <= d <= high):
+            result = storage.book_waitlisted(request['Request_id'], day, vaccine, request['Patient'])
+            if result is None:
+                # another matcher booked this request first
+                return None
+            outcome, caregiver, appointment_id, slot = result
+            if outcome == Storage.RESERVED:
+                open_slots[day] -= 1
+                return Appointment(day, vaccine, request['Patient'], caregiver, appointment_id, slot)
+            if outcome == Storage.NO_DOSES:
+                out_of_doses.add(vaccine)
+                return None
+            open_slots[day] = 0
+        return None
+
+    @staticmethod
+    def _day(value):
+        return value.date() if isinstance(value, datetime.datetime) else value
+
+    def __str__(self):
+        return f"(Request ID: {self.request_id}, Vaccine: {self.vaccine_name}, " \
+               f"Dates: {self.first} to {self.last}, Patient: {self.patient})"
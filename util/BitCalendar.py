@@ -0,0 +1,137 @@
+import datetime
+import threading
+
+
+class BitCalendar:
+    """
+    Days each member is free, one int bitset per member: bit i stands for
+    day epoch + i. Range lookups shift and mask the bitsets, so they cost a
+    few machine words per member however many rows the range covers, and a
+    member free on every day of three years takes about 140 bytes.
+
+    The epoch is the earliest day ever added; adding an earlier day shifts
+    every bitset once. Thread-safe.
+    """
+
+    __slots__ = ("epoch", "_bits", "_lock")
+
+    def __init__(self):
+        self.epoch = None
+        self._bits = {}
+        self._lock = threading.Lock()
+
+    def _offset(self, day):
+        # bit index of day, moving the epoch back first if needed; the lock is held
+        if self.epoch is None:
+            self.epoch = day
+        offset = (day - self.epoch).days
+        if offset < 0:
+            self._bits = {member: bits << -offset for member, bits in self._bits.items()}
+            self.epoch = day
+            offset = 0
+        return offset
+
+    def _window(self, first, last):
+        # (lowest bit index, mask) of [first, last] clipped to the calendar, or None if it misses it
+        if self.epoch is None or last < first:
+            return None
+        high = (last - self.epoch).days
+        if high < 0:
+            return None
+        low = max((first - self.epoch).days, 0)
+        return low, (1 << (high - low + 1)) - 1
+
+    def _days(self, bits, low):
+        # the days whose bits are set in a window starting at bit index low
+        while bits:
+            lowest = bits & -bits
+            yield self.epoch + datetime.timedelta(days=low + lowest.bit_length() - 1)
+            bits ^= lowest
+
+    def add(self, member, day):
+        with self._lock:
+            offset = self._offset(day)
+            self._bits[member] = self._bits.get(member, 0) | (1 << offset)
+
+    def add_many(self, member, days):
+        days = list(days)
+        if not days:
+            return
+        with self._lock:
+            self._offset(min(days))
+            bits = self._bits.get(member, 0)
+            for day in days:
+                bits |= 1 << (day - self.epoch).days
+            self._bits[member] = bits
+
+    def remove(self, member, day):
+        with self._lock:
+            bits = self._bits.get(member, 0)
+            offset = (day - self.epoch).days if self.epoch is not None else -1
+            if offset < 0 or not bits >> offset & 1:
+                return
+            bits &= ~(1 << offset)
+            if bits:
+                self._bits[member] = bits
+            else:
+                del self._bits[member]
+
+    def is_free(self, member, day):
+        with self._lock:
+            offset = (day - self.epoch).days if self.epoch is not None else -1
+            return offset >= 0 and bool(self._bits.get(member, 0) >> offset & 1)
+
+    def members_on(self, day):
+        """Members free on day, sorted."""
+        with self._lock:
+            offset = (day - self.epoch).days if self.epoch is not None else -1
+            if offset < 0:
+                return []
+            return sorted(member for member, bits in self._bits.items() if bits >> offset & 1)
+
+    def members_by_day(self, first, last):
+        """{day: members free that day, sorted} for the days in [first, last] anyone is free."""
+        with self._lock:
+            window = self._window(first, last)
+            if window is None:
+                return {}
+            low, mask = window
+            by_day = {}
+            for member, bits in self._bits.items():
+                for day in self._days((bits >> low) & mask, low):
+                    by_day.setdefault(day, []).append(member)
+        for members in by_day.values():
+            members.sort()
+        return dict(sorted(by_day.items()))
+
+    def free_days(self, first, last, members=None):
+        """Days in [first, last] on which any of members (default: anyone) is free."""
+        with self._lock:
+            window = self._window(first, last)
+            if window is None:
+                return []
+            low, mask = window
+            union = 0
+            for member in self._bits if members is None else members:
+                union |= self._bits.get(member, 0) >> low
+            return list(self._days(union & mask, low))
+
+    def common_days(self, members, first, last):
+        """Days in [first, last] on which every one of members is free."""
+        with self._lock:
+            window = self._window(first, last)
+            if window is None:
+                return []
+            low, mask = window
+            common = mask
+            for member in members:
+                common &= self._bits.get(member, 0) >> low
+            return list(self._days(common, low))
+
+    def __len__(self):
+        return len(self._bits)
+
+    def nbytes(self):
+        # payload of the bitsets, ignoring per-object overhead
+        with self._lock:
+            return sum((bits.bit_length() + 7) // 8 for bits in self._bits.values())
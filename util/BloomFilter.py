@@ -0,0 +1,48 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives: an item
+    that was added is always reported present, one that was not is reported
+    present with probability about error_rate. Sized for capacity items; a
+    million names at 1% take about 1.2 MB. Positions come from one blake2b
+    digest by double hashing. Thread-safe.
+    """
+
+    __slots__ = ("size", "hashes", "count", "_bits", "_lock")
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            return all(self._bits[position >> 3] >> (position & 7) & 1 for position in positions)
+
+    def __len__(self):
+        # items added, counting repeats
+        return self.count
+
+    def nbytes(self):
+        return len(self._bits)
@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while what they call keeps failing. Closed, every call
+    is allowed and consecutive failures are counted; threshold of them open
+    the breaker, which then refuses calls for cooldown seconds. After that it
+    is half-open: one trial call is allowed, and its success closes the
+    breaker while its failure opens it again. Thread-safe.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=5, cooldown=10.0):
+        self.threshold = max(threshold, 1)
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go ahead now; a call that is allowed must report success() or failure()."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._trial):
+                self._trial = self.state == self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened += 1
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def is_open(self):
+        # whether calls are refused right now; unlike allow() it neither admits a call nor counts one as rejected
+        with self._lock:
+            return self.state == self.OPEN
+
+    def retry_after(self):
+        # seconds until an open breaker lets a trial call through
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
@@ -0,0 +1,21 @@
+import datetime
+import math
+
+
+def forecast_depletion(usage, stock, days, today):
+    """
+    Project when each vaccine runs out at its recent rate of use.
+
+    usage is {vaccine: (doses booked in the days window, busiest day's
+    doses)}, already totalled by the database; stock is {vaccine: doses
+    left}. Returns {vaccine: (doses per day, busiest day's doses, depletion
+    date or None if the vaccine is not being used)}.
+    """
+    forecast = {}
+    for name in sorted(set(stock) | set(usage)):
+        total, peak = usage.get(name, (0, 0))
+        rate = total / days if days else 0.0
+        left = max(stock.get(name, 0), 0)
+        depletion = today + datetime.timedelta(days=math.floor(left / rate)) if rate > 0 else None
+        forecast[name] = (rate, peak, depletion)
+    return forecast
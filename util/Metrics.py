@@ -0,0 +1,192 @@
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Per-command latency histograms plus the connections opened and statements
+    issued while each command ran, and a log of slow statements.
+
+    Commands are timed with `with metrics.command(name):`; Storage and
+    ConnectionManager report statements and connects, which are attributed to
+    the command running in the same context. When disabled every hook returns
+    after a single attribute check.
+    """
+
+    # histogram bucket upper bounds in seconds
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+    # label for statements/connections that happen outside any command (startup, background work)
+    NO_COMMAND = "none"
+
+    _whitespace = re.compile(r"\s+")
+
+    def __init__(self, enabled=True, slow_query_seconds=0.2, slow_log_size=100, export_path=None,
+                 export_interval=10.0):
+        self.enabled = enabled
+        self.slow_query_seconds = slow_query_seconds
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self.slow_queries = deque(maxlen=slow_log_size)
+        # extra gauges/counters other components publish, as name -> callable returning {labels: value}
+        self.collectors = {}
+        self._command = contextvars.ContextVar("command", default=self.NO_COMMAND)
+        self._lock = threading.Lock()
+        self._last_export = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.durations = {}
+            self.queries = {}
+            self.query_seconds = {}
+            self.connections = {}
+            self.slow_queries.clear()
+
+    @contextmanager
+    def command(self, name):
+        if not self.enabled:
+            yield
+            return
+        token = self._command.set(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._command.reset(token)
+            self._observe(name, elapsed)
+            self.maybe_export()
+
+    def current_command(self):
+        return self._command.get()
+
+    def _observe(self, name, elapsed):
+        with self._lock:
+            counts = self.histograms.get(name)
+            if counts is None:
+                counts = self.histograms[name] = [0] * len(self.BUCKETS)
+            for i, bound in enumerate(self.BUCKETS):
+                if elapsed <= bound:
+                    counts[i] += 1
+                    break
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def record_query(self, statement, params, elapsed):
+        name = self._command.get()
+        with self._lock:
+            self.queries[name] = self.queries.get(name, 0) + 1
+            self.query_seconds[name] = self.query_seconds.get(name, 0.0) + elapsed
+        if elapsed >= self.slow_query_seconds:
+            self._log_slow_query(name, statement, params, elapsed)
+
+    def record_connection(self):
+        name = self._command.get()
+        with self._lock:
+            self.connections[name] = self.connections.get(name, 0) + 1
+
+    def _log_slow_query(self, name, statement, params, elapsed):
+        # parameter values may be passwords, hashes or patient names: only their count is kept
+        entry = {
+            "command": name,
+            "seconds": round(elapsed, 6),
+            "sql": self._whitespace.sub(" ", statement).strip(),
+            "params": f"<{len(params)} redacted>",
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.slow_queries.append(entry)
+        print(f"slow query ({entry['seconds']}s in {name}): {entry['sql']} {entry['params']}", file=sys.stderr)
+
+    # reporting
+
+    def percentile(self, name, p):
+        # upper bound of the bucket holding the p-th percentile
+        counts = self.histograms.get(name)
+        if not counts:
+            return 0.0
+        target = p / 100.0 * sum(counts)
+        seen = 0
+        for bound, count in zip(self.BUCKETS, counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.BUCKETS[-1]
+
+    def summary(self):
+        rows = []
+        with self._lock:
+            for name in sorted(self.histograms):
+                count = sum(self.histograms[name])
+                rows.append({
+                    "command": name,
+                    "count": count,
+                    "mean_ms": round(self.durations[name] / count * 1000, 3),
+                    "p50_ms": self.percentile(name, 50) * 1000,
+                    "p95_ms": self.percentile(name, 95) * 1000,
+                    "p99_ms": self.percentile(name, 99) * 1000,
+                    "queries_per_command": round(self.queries.get(name, 0) / count, 2),
+                    "connections_opened": self.connections.get(name, 0),
+                })
+        return rows
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP scheduler_command_seconds Latency of scheduler commands.",
+            "# TYPE scheduler_command_seconds histogram",
+        ]
+        with self._lock:
+            for name in sorted(self.histograms):
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS, self.histograms[name]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'scheduler_command_seconds_bucket{{command="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'scheduler_command_seconds_sum{{command="{name}"}} {self.durations[name]}')
+                lines.append(f'scheduler_command_seconds_count{{command="{name}"}} {cumulative}')
+            for metric, help_text, values in (
+                    ("scheduler_queries_total", "Statements issued, by command.", self.queries),
+                    ("scheduler_query_seconds_total", "Time spent in statements, by command.", self.query_seconds),
+                    ("scheduler_connections_opened_total", "Database connections opened, by command.",
+                     self.connections)):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for name in sorted(values):
+                    lines.append(f'{metric}{{command="{name}"}} {values[name]}')
+        for metric, collect in sorted(self.collectors.items()):
+            lines.append(f"# TYPE {metric} gauge")
+            for labels, value in sorted(collect().items()):
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=None):
+        path = path or self.export_path
+        if not path:
+            return
+        # write then rename so a scraper never reads a half-written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def maybe_export(self):
+        if self.export_path and time.monotonic() - self._last_export >= self.export_interval:
+            self._last_export = time.monotonic()
+            try:
+                self.export()
+            except OSError as e:
+                print(f"Could not write metrics file: {e}", file=sys.stderr)
+
+
+metrics = Metrics(
+    enabled=os.getenv("Metrics", "1") != "0",
+    slow_query_seconds=float(os.getenv("SlowQueryMs", "200")) / 1000,
+    export_path=os.getenv("MetricsFile"),
+    export_interval=float(os.getenv("MetricsInterval", "10")),
+)
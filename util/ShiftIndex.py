@@ -0,0 +1,65 @@
+import heapq
+
+
+class ShiftIndex:
+    """
+    Interval index over one day's shifts: each shift is [start, end) in
+    minutes after midnight, split into slots of a fixed length, and a slot is
+    free unless (member, slot start) is booked. Slots are never materialized;
+    free_slots() merges the shifts' slot sequences through a heap, so the
+    earliest free slot costs O(log shifts) plus the booked slots it skips.
+    An index is a snapshot; Storage replaces it rather than updating it.
+    """
+
+    __slots__ = ("shifts", "booked")
+
+    def __init__(self, shifts=(), booked=()):
+        # (start, end, slot length, member), by start
+        self.shifts = sorted(shifts)
+        self.booked = frozenset(booked)
+
+    @staticmethod
+    def _first_slot(start, end, length, not_before):
+        # start of the shift's first slot at or after not_before, or None if the shift has none left
+        if not_before > start:
+            start += -(-(not_before - start) // length) * length
+        return start if start + length <= end else None
+
+    def free_slots(self, not_before=0, rank=None):
+        """
+        Yield (slot start, member) for every free slot at or after not_before,
+        earliest first; members free at the same time come in rank order
+        ({member: position}, members missing from it last) and then by name.
+        """
+        rank = rank or {}
+        heap = []
+        for start, end, length, member in self.shifts:
+            slot = self._first_slot(start, end, length, not_before)
+            if slot is not None:
+                heap.append((slot, rank.get(member, len(rank)), member, end, length))
+        heapq.heapify(heap)
+        while heap:
+            slot, position, member, end, length = heap[0]
+            if (member, slot) not in self.booked:
+                yield slot, member
+            if slot + 2 * length <= end:
+                heapq.heapreplace(heap, (slot + length, position, member, end, length))
+            else:
+                heapq.heappop(heap)
+
+    def members(self):
+        return sorted({member for start, end, length, member in self.shifts})
+
+    def summary(self):
+        """{member: (shifts as [(start, end)], free slot count, earliest free slot or None)}."""
+        result = {}
+        for start, end, length, member in self.shifts:
+            shifts, free, earliest = result.get(member, ([], 0, None))
+            slots = [s for s in range(start, end - length + 1, length) if (member, s) not in self.booked]
+            if slots and (earliest is None or slots[0] < earliest):
+                earliest = slots[0]
+            result[member] = (shifts + [(start, end)], free + len(slots), earliest)
+        return result
+
+    def __len__(self):
+        return len(self.shifts)
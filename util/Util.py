@@ -0,0 +1,61 @@
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _pbkdf2(password, salt, work_factor):
+    # module level so worker processes can unpickle it
+    return hashlib.pbkdf2_hmac(
+        'sha256',
+        password.encode('utf-8'),
+        salt,
+        work_factor,
+        dklen=16
+    )
+
+
+class Util:
+    # PBKDF2 iterations for new hashes; raising it makes existing users rehash on their next login
+    WORK_FACTOR = int(os.getenv("HashWorkFactor", "100000"))
+    # work factor of hashes stored before it was recorded alongside them
+    LEGACY_WORK_FACTOR = 100000
+    # processes computing hashes; 0 hashes inline on the calling thread
+    WORKERS = int(os.getenv("HashWorkers", str(os.cpu_count() or 1)))
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @staticmethod
+    def generate_salt():
+        return os.urandom(16)
+
+    @staticmethod
+    def generate_hash(password, salt, work_factor=None):
+        if work_factor is None:
+            work_factor = Util.WORK_FACTOR
+        executor = Util._hash_executor()
+        if executor is None:
+            return _pbkdf2(password, salt, work_factor)
+        # the KDF is CPU bound; running it in another process keeps it off this process's GIL
+        return executor.submit(_pbkdf2, password, salt, work_factor).result()
+
+    @staticmethod
+    def verify_hash(password, salt, expected_hash, work_factor=None):
+        calculated_hash = Util.generate_hash(password, salt, work_factor)
+        return hmac.compare_digest(calculated_hash, bytes(expected_hash))
+
+    @staticmethod
+    def _hash_executor():
+        if Util.WORKERS <= 0:
+            return None
+        if Util._executor is None:
+            with Util._executor_lock:
+                if Util._executor is None:
+                    # spawned, not forked: the first hash often comes from a server worker thread, and a
+                    # fork there would hand the children the open sockets and whatever locks other threads hold
+                    Util._executor = ProcessPoolExecutor(max_workers=Util.WORKERS,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+        return Util._executor